@@ -19,15 +19,39 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import datetime
+import json
 import os
+import shutil
+import stat
+import subprocess
 import sys
+import threading
+import Queue
 from yaclifw.framework import Command, Stop
+from scc.git import add_jobs_argument, hash_object, hash_objects, BlobCache
+
+
+# Removes the folders given as arguments, ignoring errors
+RMTREES = """
+import shutil, sys
+for path in sys.argv[1:]:
+    shutil.rmtree(path, True)
+"""
+
+
+def timestamp():
+    """Return the current UTC time as a sortable string."""
+    return datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
 
 
 class Deploy(Command):
     """
     Deploy an update to a website using the "symlink swapping" strategy.
     See https://gist.github.com/3807742.
+
+    Symbolic links of the deployed content are followed and their targets
+    copied, as by shutil.copytree. Broken links are reported and skipped.
     """
 
     NAME = "deploy"
@@ -35,9 +59,36 @@ class Deploy(Command):
     def __init__(self, sub_parsers):
         super(Deploy, self).__init__(sub_parsers)
 
-        self.parser.add_argument(
+        group = self.parser.add_mutually_exclusive_group()
+        group.add_argument(
             '--init', action='store_true',
             help='Prepare a folder with content for "symlink swapping"')
+        group.add_argument(
+            '--rollback', action='store_true',
+            help='Point the folder back at the previous release')
+        group.add_argument(
+            '--verify', action='store_true',
+            help='Check the deployed content against its manifest')
+        self.parser.add_argument(
+            '--releases', type=int, metavar='N',
+            help='Keep the last N releases in timestamped folders and '
+            'deploy by moving the new content into a new release')
+        add_jobs_argument(
+            self.parser, default=4,
+            help="Number of files copied or hashed concurrently")
+        self.parser.add_argument(
+            '--incremental', action='store_true',
+            help='Hardlink the files unchanged since the previous deploy '
+            'instead of copying them')
+        self.parser.add_argument(
+            '--compare', choices=('mtime', 'hash'), default='mtime',
+            help='How unchanged files are detected in incremental mode: '
+            'same size and modification time, or same content '
+            '(default: %(default)s)')
+        self.parser.add_argument(
+            '--manifest', action='store_true',
+            help='Write a manifest of the deployed content for --verify. '
+            'Implied by --releases and by --incremental --compare hash')
         self.parser.add_argument(
             'folder', type=str,
             help="The folder to be deployed/updated")
@@ -48,11 +99,35 @@ class Deploy(Command):
         self.folder = args.folder
         self.live_folder = self.folder + ".live"
         self.tmp_folder = self.folder + ".tmp"
+        self.releases_folder = self.folder + ".releases"
+        self.trash_folder = self.folder + ".trash"
+        self.cache_path = self.folder + ".blobcache"
+        self.incremental = args.incremental
+        self.compare = args.compare
+        self.manifest = bool(args.manifest or args.releases or (
+            args.incremental and args.compare == "hash"))
+        self.jobs = max(args.jobs, 1)
+        self.blobs = {}
+        self.trashed = []
 
-        if args.init:
-            self.doc_init()
-        else:
-            self.doc_deploy()
+        if args.releases is not None and args.releases < 1:
+            raise Stop(5, "At least one release must be kept")
+
+        try:
+            if args.verify:
+                self.doc_verify()
+            elif args.rollback:
+                self.release_rollback()
+            elif args.releases and args.init:
+                self.release_init()
+            elif args.releases:
+                self.release_deploy(args.releases)
+            elif args.init:
+                self.doc_init()
+            else:
+                self.doc_deploy()
+        finally:
+            self.empty_trash()
 
     def doc_init(self):
         """
@@ -70,7 +145,10 @@ class Deploy(Command):
                        " argument." % self.live_folder)
 
         self.copytree(self.folder, self.live_folder)
-        self.rmtree(self.folder)
+        if self.manifest:
+            self.write_manifest(self.live_folder,
+                                self.build_manifest(self.live_folder))
+        self.trash(self.folder)
         self.symlink(self.live_folder, self.folder)
 
     def doc_deploy(self):
@@ -96,31 +174,392 @@ class Deploy(Command):
                        "Copy the new content to be deployed to this folder "
                        "and  run scc deploy again." % self.tmp_folder)
 
-        self.symlink(self.tmp_folder, self.folder)
-        self.rmtree(self.live_folder)
+        if self.manifest:
+            previous = self.read_manifest(self.live_folder)
+            manifest = self.build_manifest(self.tmp_folder, previous)
+            self.add_blobs(self.live_folder, previous)
+            self.add_blobs(self.tmp_folder, manifest)
 
-        self.copytree(self.tmp_folder, self.live_folder)
+        self.symlink(self.tmp_folder, self.folder)
+        if self.incremental:
+            new_folder = self.live_folder + ".new"
+            if os.path.exists(new_folder):
+                self.trash(new_folder)
+            self.copytree(self.tmp_folder, new_folder, self.live_folder)
+            self.trash(self.live_folder)
+            os.rename(new_folder, self.live_folder)
+        else:
+            self.trash(self.live_folder)
+            self.copytree(self.tmp_folder, self.live_folder)
+        if self.manifest:
+            self.write_manifest(
+                self.live_folder,
+                self.restat_manifest(self.live_folder, manifest))
+        else:
+            # A manifest of the previous content would no longer match
+            self.remove_manifest(self.live_folder)
         self.symlink(self.live_folder, self.folder)
 
-        self.rmtree(self.tmp_folder)
+        self.trash(self.tmp_folder)
+
+    def release_init(self):
+        """
+        Set up the versioned releases structure, moving the content of the
+        folder into a first release.
+        """
+
+        if not os.path.exists(self.folder):
+            raise Stop(5, "The following path does not exist: %s. "
+                       "Copy some contents to this folder and run"
+                       " scc deploy --init again." % self.folder)
+
+        if os.path.exists(self.releases_folder):
+            raise Stop(5, "The following path already exists: %s. "
+                       "Run the scc deploy command without the --init"
+                       " argument." % self.releases_folder)
+
+        os.mkdir(self.releases_folder)
+        release = self.new_release()
+        os.rename(self.folder, release)
+        self.write_manifest(release, self.build_manifest(release))
+        self.symlink(release, self.folder)
+
+    def release_deploy(self, keep):
+        """
+        Deploy a new content by moving it into a new release and swapping
+        the symlink to point at it. Releases beyond the last keep ones are
+        removed in the background.
+        """
+
+        self.check_releases()
+        if not os.path.exists(self.tmp_folder):
+            raise Stop(5, "The following path does not exist: %s. "
+                       "Copy the new content to be deployed to this folder "
+                       "and  run scc deploy again." % self.tmp_folder)
+
+        previous = self.read_manifest(
+            os.path.join(self.releases_folder, self.current_release()))
+        release = self.new_release()
+        os.rename(self.tmp_folder, release)
+        self.write_manifest(release, self.build_manifest(release, previous))
+        self.symlink(release, self.folder)
+
+        for name in self.list_releases()[:-keep]:
+            if name != self.current_release():
+                path = os.path.join(self.releases_folder, name)
+                self.trash(path)
+                self.remove_manifest(path)
+
+    def release_rollback(self):
+        """
+        Point the folder at the release preceding the current one.
+        """
+
+        self.check_releases()
+        releases = self.list_releases()
+        current = self.current_release()
+        if current not in releases or releases.index(current) == 0:
+            raise Stop(5, "No release older than %s to roll back to."
+                       % current)
+        previous = releases[releases.index(current) - 1]
+        self.symlink(os.path.join(self.releases_folder, previous),
+                     self.folder)
+
+    def check_releases(self):
+        if not os.path.isdir(self.releases_folder):
+            raise Stop(5, "The following path does not exist: %s. "
+                       "Pass --init --releases to the scc deploy command to "
+                       "initialize the releases." % self.releases_folder)
+
+        if not os.path.islink(self.folder):
+            raise Stop(5, "The following path is not a symlink: %s. "
+                       "Pass --init --releases to the scc deploy command to "
+                       "initialize the releases." % self.folder)
+
+    def list_releases(self):
+        """Return the names of the releases, oldest first."""
+        return sorted(x for x in os.listdir(self.releases_folder)
+                      if os.path.isdir(os.path.join(self.releases_folder, x)))
+
+    def current_release(self):
+        return os.path.basename(os.path.normpath(os.readlink(self.folder)))
 
-    def copytree(self, src, dst):
-        import shutil
-        self.dbg("Copying %s/* to %s/*", src, dst)
+    def new_release(self):
+        """Return the path of a new release named after the current time."""
+        return os.path.join(self.releases_folder, timestamp())
+
+    def doc_verify(self):
+        """
+        Check the content the folder points at against its manifest,
+        hashing every file again concurrently.
+        """
+
+        tree = os.path.realpath(self.folder)
+        manifest = self.read_manifest(tree)
+        if manifest is None:
+            raise Stop(5, "The following path does not exist: %s. "
+                       "Run scc deploy again to write the manifest."
+                       % self.manifest_path(tree))
+
+        files = dict(self.list_files(tree))
+        common = sorted(set(files) & set(manifest))
+        shas = hash_objects([files[x] for x in common], jobs=self.jobs)
+        errors = 0
+        for rel in sorted(set(manifest) - set(files)):
+            print >> sys.stderr, "Missing file %s" % rel
+            errors += 1
+        for rel in sorted(set(files) - set(manifest)):
+            print >> sys.stderr, "Unexpected file %s" % rel
+            errors += 1
+        for rel, sha in zip(common, shas):
+            if sha != manifest[rel][2]:
+                print >> sys.stderr, "Modified file %s" % rel
+                errors += 1
+        if errors:
+            raise Stop(6, "%s file(s) of %s do not match the manifest"
+                       % (errors, tree))
+        print "Verified %s file(s) of %s" % (len(common), tree)
+
+    def list_files(self, tree):
+        """
+        Yield the relative and full paths of the files of a tree, following
+        symbolic links and skipping broken ones as copytree does.
+        """
+        for root, dirnames, filenames in os.walk(tree, followlinks=True):
+            for name in filenames:
+                path = os.path.join(root, name)
+                if os.path.exists(path):
+                    yield os.path.relpath(path, tree), path
+
+    def build_manifest(self, tree, previous=None):
+        """
+        Return the manifest of a tree: the size, modification time and git
+        blob SHA of each file keyed by relative path. The SHAs of the files
+        with the same size and modification time as in the previous
+        manifest are reused, the other files are looked up in the blob
+        cache next to the folder or hashed concurrently.
+        """
+        previous = previous or {}
+        manifest = {}
+        pending = []
+        for rel, path in self.list_files(tree):
+            st = os.stat(path)
+            entry = [st.st_size, st.st_mtime]
+            if previous.get(rel, [])[:2] == entry:
+                entry.append(previous[rel][2])
+            else:
+                pending.append(rel)
+            manifest[rel] = entry
+        self.dbg("Hashing %s of %s file(s) of %s", len(pending),
+                 len(manifest), tree)
+        cache = BlobCache(self.cache_path)
+        try:
+            shas = hash_objects([os.path.join(tree, x) for x in pending],
+                                jobs=self.jobs, cache=cache)
+            cache.prune()
+        finally:
+            cache.close()
+        for rel, sha in zip(pending, shas):
+            manifest[rel].append(sha)
+        return manifest
+
+    def restat_manifest(self, tree, manifest):
+        """
+        Return the manifest of a copy of a tree, reusing its SHAs.
+        """
+        copy = {}
+        for rel, entry in manifest.iteritems():
+            try:
+                st = os.stat(os.path.join(tree, rel))
+            except OSError:
+                continue
+            copy[rel] = [st.st_size, st.st_mtime, entry[2]]
+        return copy
+
+    def manifest_path(self, tree):
+        return os.path.normpath(tree) + ".manifest"
+
+    def read_manifest(self, tree):
+        path = self.manifest_path(tree)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def write_manifest(self, tree, manifest):
+        path = self.manifest_path(tree)
+        self.dbg("Writing manifest %s", path)
+        with open(path + ".new", "w") as f:
+            json.dump(manifest, f, sort_keys=True)
+        os.rename(path + ".new", path)
+
+    def remove_manifest(self, tree):
+        path = self.manifest_path(tree)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def add_blobs(self, tree, manifest):
+        """
+        Record the manifest entries of a tree by full path, for unchanged
+        files to be compared without being hashed again.
+        """
+        for rel, entry in (manifest or {}).iteritems():
+            self.blobs[os.path.normpath(os.path.join(tree, rel))] = entry
+
+    def blob_sha(self, path):
+        """
+        Return the git blob SHA of a file, as recorded in a manifest if the
+        file has not changed since.
+        """
+        entry = self.blobs.get(os.path.normpath(path))
+        if entry:
+            st = os.stat(path)
+            if [st.st_size, st.st_mtime] == entry[:2]:
+                return entry[2]
+        return hash_object(path)
+
+    def copytree(self, src, dst, previous=None):
+        """
+        Copy the content of src to dst following symbolic links, like
+        shutil.copytree: the files and folders they point at are copied,
+        not the links themselves. The files are copied by a pool of worker
+        threads fed through a bounded queue while the tree is walked. With
+        a previous tree, the files unchanged since then are hardlinked
+        rather than copied. Unexpected errors of the workers are raised
+        once all of them have stopped.
+        """
+        if previous:
+            self.dbg("Copying %s/* to %s/* with links to %s/*", src, dst,
+                     previous)
+        else:
+            self.dbg("Copying %s/* to %s/*", src, dst)
+        errors = []
+        failures = []
+        linked = []
+        tasks = Queue.Queue(maxsize=2 * self.jobs)
+
+        def onerror(error):
+            errors.append((error.filename, None, str(error)))
+
+        workers = [threading.Thread(
+            target=self.copy_worker, name="copy-%s" % i,
+            args=(tasks, linked, errors, failures))
+            for i in range(self.jobs)]
+        for thread in workers:
+            thread.start()
+        dirs = []
+        count = 0
         try:
-            shutil.copytree(src, dst)
-        except shutil.Error, e:
-            for src, dst, error in e.args[0]:
-                if os.path.islink(src):
-                    print >> sys.stderr, "Could not copy symbolic link %s" \
-                        % src
-                else:
-                    print >> sys.stderr, "Could not copy %s" % src
-
-    def rmtree(self, src):
-        import shutil
-        self.dbg("Removing %s folder", src)
-        shutil.rmtree(src)
+            for root, dirnames, filenames in os.walk(
+                    src, onerror=onerror, followlinks=True):
+                rel = os.path.relpath(root, src)
+                os.mkdir(os.path.normpath(os.path.join(dst, rel)))
+                dirs.append(rel)
+                for name in filenames:
+                    prevname = None
+                    if previous:
+                        prevname = os.path.normpath(
+                            os.path.join(previous, rel, name))
+                    tasks.put((os.path.join(root, name),
+                               os.path.normpath(os.path.join(dst, rel, name)),
+                               prevname))
+                    count += 1
+        finally:
+            for thread in workers:
+                tasks.put(None)
+            for thread in workers:
+                thread.join()
+        if failures:
+            raise failures[0][0], failures[0][1], failures[0][2]
+        for rel in reversed(dirs):
+            shutil.copystat(os.path.join(src, rel), os.path.join(dst, rel))
+        self.dbg("Copied %s file(s), linked %s unchanged file(s)",
+                 count - len(linked) - len(errors), len(linked))
+        self.report_errors(errors)
+
+    def copy_worker(self, tasks, linked, errors, failures):
+        """
+        Copy the files queued by copytree until a None task is received,
+        recording the linked files, the copy errors and the unexpected
+        failures.
+        """
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            try:
+                if self.copyfile(*task):
+                    linked.append(task[0])
+            except EnvironmentError, why:
+                errors.append((task[0], task[1], str(why)))
+            except Exception:
+                # Keep consuming the tasks for the walk not to block
+                failures.append(sys.exc_info())
+
+    def copyfile(self, src, dst, previous=None):
+        """
+        Copy a file, or hardlink its previous version if unchanged.
+
+        Returns: whether the file was linked
+        """
+        if previous and self.unchanged(src, previous):
+            try:
+                os.link(previous, dst)
+                return True
+            except OSError:
+                pass
+        shutil.copy2(src, dst)
+        return False
+
+    def unchanged(self, src, previous):
+        """
+        Return whether a file has the same content as in the previous tree,
+        as judged by its size and modification time, or by its content.
+        """
+        try:
+            src_stat = os.stat(src)
+            prev_stat = os.lstat(previous)
+        except OSError:
+            return False
+        if not stat.S_ISREG(prev_stat.st_mode) or \
+                src_stat.st_size != prev_stat.st_size:
+            return False
+        if self.compare == "hash":
+            return self.blob_sha(src) == self.blob_sha(previous)
+        return int(src_stat.st_mtime) == int(prev_stat.st_mtime)
+
+    def report_errors(self, errors):
+        for src, dst, error in errors:
+            if os.path.islink(src):
+                print >> sys.stderr, "Could not copy symbolic link %s" \
+                    % src
+            else:
+                print >> sys.stderr, "Could not copy %s" % src
+
+    def trash(self, path):
+        """
+        Atomically move a folder out of the way into the trash folder. Its
+        removal is deferred until the new content is live.
+        """
+        if not os.path.isdir(self.trash_folder):
+            os.mkdir(self.trash_folder)
+        name = os.path.join(self.trash_folder, "%s-%s" % (
+            os.path.basename(os.path.normpath(path)), timestamp()))
+        self.dbg("Moving %s folder to %s", path, name)
+        os.rename(path, name)
+        self.trashed.append(name)
+
+    def empty_trash(self):
+        """
+        Remove the trashed folders in a detached process, so that the
+        command returns as soon as the new content is live.
+        """
+        paths, self.trashed = self.trashed, []
+        if not paths:
+            return
+        self.dbg("Removing %s in the background", ", ".join(paths))
+        subprocess.Popen([sys.executable, "-c", RMTREES] + paths,
+                         close_fds=True)
 
     def symlink(self, src, link):
 
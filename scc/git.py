@@ -23,19 +23,28 @@
 import argparse
 import re
 import copy
+import hashlib
+import itertools
+import json
 import os
+import shutil
 import sys
-import uuid
+import tempfile
+import Queue
 import subprocess
 import logging
+import mmap
 import threading
+import time
 import datetime
-import difflib
+import contextlib
 import socket
+import sqlite3
 import yaml
 import six
 import warnings
 from ssl import SSLError
+from multiprocessing.pool import ThreadPool
 from yaclifw.framework import Command, Stop
 
 github_loaded = True
@@ -64,6 +73,14 @@ EMPTY_MSG = 'Empty PR description. Please add a short summary' \
     ' of the PR scope and some testing instructions.'
 
 CONFLICT_COMMENT = '--conflicts'
+FINGERPRINT_TRAILER = 'Fingerprint:'
+FETCH_OPTIONS = ('filter', 'depth', 'shallow-since', 'negotiation-tip')
+DEEPEN_DEPTH = 50
+MMAP_THRESHOLD = 1024 * 1024
+MAX_PER_PAGE = 100
+MAX_SEARCH_RESULTS = 1000
+# GitHub allows 30 search requests per minute
+SEARCH_RATE = 0.5
 #
 # Public global functions
 #
@@ -87,6 +104,44 @@ def check_exception_message(exception):
     return "Received rc=128"
 
 
+try:
+    SCC_JOBS = int(os.environ.get("SCC_JOBS"))
+except Exception:
+    SCC_JOBS = 1
+
+
+def parallel_map(function, items, jobs=SCC_JOBS):
+    """
+    Apply a function to each item using a pool of threads and return the
+    results in order. Exceptions are raised in the calling thread.
+    """
+    if jobs <= 1 or len(items) <= 1:
+        return map(function, items)
+    pool = ThreadPool(min(jobs, len(items)))
+    try:
+        return pool.map(function, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def add_jobs_argument(parser, default=1,
+                      help="Number of tasks run concurrently"):
+    """
+    Add the --jobs option shared by the commands running tasks
+    concurrently. The SCC_JOBS environment variable, if set, overrides
+    the default of the command.
+    """
+    try:
+        default = int(os.environ["SCC_JOBS"])
+    except (KeyError, ValueError):
+        pass
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=default,
+        help=help + " (default: %(default)s, overridden by the SCC_JOBS "
+        "environment variable)")
+
+
 def retry_on_error(retries=SCC_RETRIES):
     """
     Decorator for handling Github server errors
@@ -121,33 +176,58 @@ def retry_on_error(retries=SCC_RETRIES):
 def hash_object(filename):
     """
     Returns the sha1 for this file using the
-    same method as `git hash-object`
+    same method as `git hash-object`. Files larger than MMAP_THRESHOLD
+    are hashed through a read-only memory map.
     """
-    try:
-        from hashlib import sha1 as sha_new
-    except ImportError:
-        from sha import new as sha_new
-    digest = sha_new()
-    size = os.path.getsize(filename)
-    digest.update("blob %u\0" % size)
-    file = open(filename, 'rb')
-    length = 1024*1024
-    try:
-        while True:
-            block = file.read(length)
-            if not block:
-                break
-            digest.update(block)
-    finally:
-        file.close()
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update("blob %u\0" % size)
+        if size >= MMAP_THRESHOLD:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                digest.update(data)
+            finally:
+                data.close()
+        else:
+            digest.update(f.read())
     return digest.hexdigest()
 
 
+def hash_objects(filenames, jobs=SCC_JOBS, cache=None):
+    """
+    Returns the sha1 of each file as `git hash-object` would, hashing the
+    files on a pool of threads. With a BlobCache, the files whose path,
+    inode, size and modification time are unchanged are not read again
+    and the new sha1s are stored.
+    """
+    shas = [None] * len(filenames)
+    pending = []
+    for i, filename in enumerate(filenames):
+        if cache is None:
+            pending.append((i, filename, None))
+            continue
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        shas[i] = cache.get(path, st)
+        if shas[i] is None:
+            pending.append((i, path, st))
+
+    results = parallel_map(hash_object, [x[1] for x in pending], jobs)
+    for (i, path, st), sha in zip(pending, results):
+        shas[i] = sha
+    if cache is not None:
+        cache.put([(path, st, sha) for (i, path, st), sha
+                   in zip(pending, results)])
+    return shas
+
+
 def git_version(local=False):
     """
     Get the version of Git.
     """
-    p = subprocess.Popen(["git", "--version"], stdout=subprocess.PIPE)
+    p = subprocess.Popen(["git", "--version"], stdout=subprocess.PIPE,
+                         close_fds=True)
     output = p.communicate()[0].split()
     p.stdout.close()
     return tuple([int(x) for x in output[2].split(".")])
@@ -171,7 +251,7 @@ def git_config(name, user=False, local=False, value=None, config_file=None):
             pre_cmd.extend(["-f", config_file])
 
         p = subprocess.Popen(
-            pre_cmd + post_cmd, stdout=subprocess.PIPE)
+            pre_cmd + post_cmd, stdout=subprocess.PIPE, close_fds=True)
         value = p.communicate()[0]
         p.stdout.close()
         value = value.split("\n")[0].strip()
@@ -231,6 +311,8 @@ class GHManager(object):
         self.login_or_token = login_or_token
         self.dont_ask = dont_ask
         self.user_agent = user_agent
+        self.members = {}
+        self.search_throttle = Throttle(SEARCH_RATE)
         try:
             self.authorize(password)
             if login_or_token or password:
@@ -289,6 +371,61 @@ class GHManager(object):
     def get_repo(self, *args):
         return self.github.get_repo(*args)
 
+    @retry_on_error(retries=SCC_RETRIES)
+    def get_members(self, org):
+        """
+        Return the set of logins of the members of an organization. The
+        membership is only listed once per organization.
+        """
+        if org.login not in self.members:
+            self.members[org.login] = set(
+                m.login for m in org.get_members())
+        return self.members[org.login]
+
+    @retry_on_error(retries=SCC_RETRIES)
+    def get_subscriptions(self):
+        """
+        Return the set of full names of the repositories watched by the
+        authenticated user.
+        """
+        return set(r.full_name for r in self.get_user().get_subscriptions())
+
+    def search_issues(self, query):
+        """
+        Return the lazily paginated results of an issue search.
+        """
+        return self.github.search_issues(query)
+
+    @retry_on_error(retries=SCC_RETRIES)
+    def get_search_count(self, results):
+        """
+        Return the total number of results matched by a search.
+        """
+        self.search_throttle.wait()
+        return results.totalCount
+
+    @retry_on_error(retries=SCC_RETRIES)
+    def get_search_page(self, results, page):
+        """
+        Return a page of search results, spacing out the search requests
+        of all threads to the search rate limit.
+        """
+        self.search_throttle.wait()
+        return results.get_page(page)
+
+    def iter_search(self, results):
+        """
+        Yield the search results as the pages are fetched.
+        """
+        page = 0
+        while True:
+            items = self.get_search_page(results, page)
+            for item in items:
+                yield item
+            if len(items) < self.github.per_page:
+                return
+            page += 1
+
     @retry_on_error(retries=SCC_RETRIES)
     def get_rate_limit(self):
         return self.github.get_rate_limit()
@@ -342,7 +479,7 @@ class GHManager(object):
         to prevent use of the pygithub2 library.
         """
         self.github = github.Github(*args, user_agent=self.user_agent,
-                                    **kwargs)
+                                    per_page=MAX_PER_PAGE, **kwargs)
 
     @retry_on_error(retries=SCC_RETRIES)
     def __getattr__(self, key):
@@ -380,6 +517,242 @@ class DefaultList(list):
         return []
 
 
+class ChangedFiles(object):
+    """
+    Dictionary of the paths changed by each merged pull request.
+
+    An inverted index mapping each changed path and each of its parent
+    directories to the pull requests which changed it is maintained as
+    pull requests are added, so that the pull requests changing a given
+    path can be found without scanning the files of all pull requests.
+    Directory entries are stored with a trailing slash.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.index = {}
+
+    def __setitem__(self, pullrequest, files):
+        if pullrequest in self.files:
+            del self[pullrequest]
+        self.files[pullrequest] = set(files)
+        for path in self.files[pullrequest]:
+            for key in self.get_keys(path):
+                pulls = self.index.setdefault(key, [])
+                if not pulls or pulls[-1] is not pullrequest:
+                    pulls.append(pullrequest)
+
+    def __delitem__(self, pullrequest):
+        for path in self.files.pop(pullrequest):
+            for key in self.get_keys(path):
+                pulls = self.index.get(key, [])
+                if pullrequest in pulls:
+                    pulls.remove(pullrequest)
+
+    def __getitem__(self, pullrequest):
+        return self.files[pullrequest]
+
+    def __contains__(self, pullrequest):
+        return pullrequest in self.files
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    def iteritems(self):
+        return self.files.iteritems()
+
+    @staticmethod
+    def get_keys(path):
+        """Return the index keys of a path and of its parent directories"""
+        keys = [path]
+        parts = path.split("/")[:-1]
+        for i in range(len(parts), 0, -1):
+            keys.append("/".join(parts[:i]) + "/")
+        return keys
+
+    def find(self, path):
+        """
+        Return the pull requests which changed a path, or any path under it
+        if it is a directory, in the order they were added.
+        """
+        if path is None:
+            return []
+        pulls = list(self.index.get(path, []))
+        for pullrequest in self.index.get(path.rstrip("/") + "/", []):
+            if pullrequest not in pulls:
+                pulls.append(pullrequest)
+        return pulls
+
+
+class MergeReport(object):
+    """
+    Stream of merge events written as newline-delimited JSON records.
+
+    Each record holds the event name, its timestamp and the event fields.
+    Records are written and flushed as soon as they are emitted so that
+    the report can be followed while merging. Without a stream, the
+    events are discarded once returned.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def emit(self, event, **fields):
+        """Write an event record to the stream and return it"""
+        record = {"event": event, "time": round(time.time(), 3)}
+        record.update(fields)
+        if self.stream is not None:
+            self.stream.write(json.dumps(record, sort_keys=True) + "\n")
+            self.stream.flush()
+        return record
+
+    @contextlib.contextmanager
+    def timed(self, event, **fields):
+        """
+        Emit an event with the duration of the enclosed block, including
+        the error if the block raises. The yielded dictionary can be used
+        to add fields to the event.
+        """
+        start = time.time()
+        try:
+            yield fields
+        except BaseException, e:
+            fields["error"] = str(e) or e.__class__.__name__
+            raise
+        finally:
+            fields["duration"] = round(time.time() - start, 3)
+            self.emit(event, **fields)
+
+
+class LinksStore(object):
+    """
+    SQLite store of the rebase links of the pull requests of a repository.
+
+    Each row holds the parsed rebase links of a pull request (None without
+    rebase comment, -1 if marked as no-rebase), its merged state, whether
+    its links are known to be rebased and the time of its last update.
+    Rows are written as soon as they change and the database can be
+    shared by concurrent processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS links ("
+                "number INTEGER PRIMARY KEY, links TEXT, merged INTEGER, "
+                "rebased INTEGER, updated_at TEXT)")
+
+    def get(self, number):
+        """Return the (links, merged, rebased, updated_at) of a PR"""
+        row = self.db.execute(
+            "SELECT links, merged, rebased, updated_at FROM links "
+            "WHERE number = ?", (number,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), bool(row[1]), bool(row[2]), row[3]
+
+    def get_rebased(self):
+        """Return a dictionary of the links of the rebased PRs"""
+        rows = self.db.execute(
+            "SELECT number, links FROM links WHERE rebased")
+        return dict((number, json.loads(links)) for number, links in rows)
+
+    def put(self, number, links, merged, updated_at):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO links VALUES (?, ?, ?, 0, ?)",
+                (number, json.dumps(links), int(bool(merged)), updated_at))
+
+    def set_rebased(self, numbers, rebased=True):
+        with self.db:
+            self.db.executemany(
+                "UPDATE links SET rebased = ? WHERE number = ?",
+                [(int(rebased), x) for x in numbers])
+
+    def import_links(self, links):
+        """Import the rebased links of the legacy pickle cache"""
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO links VALUES (?, ?, 1, 1, NULL)",
+                [(k, json.dumps(v)) for k, v in links.iteritems()])
+
+    def close(self):
+        self.db.close()
+
+
+class BlobCache(object):
+    """
+    SQLite cache of the git blob sha1s of files.
+
+    Each row holds the sha1 of a file keyed by its absolute path, and is
+    only valid while the inode, size and modification time of the file
+    are unchanged. The database can be shared by concurrent processes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                "path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, "
+                "mtime REAL, sha TEXT)")
+
+    def get(self, path, st):
+        """Return the sha1 of a file given its stat result, or None"""
+        row = self.db.execute(
+            "SELECT sha FROM blobs WHERE path = ? AND inode = ? AND "
+            "size = ? AND mtime = ?",
+            (path, st.st_ino, st.st_size, st.st_mtime)).fetchone()
+        return row[0] if row else None
+
+    def put(self, entries):
+        """Store the (path, stat result, sha1) of several files"""
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?)",
+                [(path, st.st_ino, st.st_size, st.st_mtime, sha)
+                 for path, st, sha in entries])
+
+    def prune(self):
+        """Remove the rows of the files which no longer exist"""
+        paths = [row[0] for row in self.db.execute("SELECT path FROM blobs")]
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM blobs WHERE path = ?",
+                [(x,) for x in paths if not os.path.exists(x)])
+
+    def close(self):
+        self.db.close()
+
+
+class Throttle(object):
+    """
+    Space out the calls of several threads to a maximum rate per second.
+    Without a rate, calls are not delayed.
+    """
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_call = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
 class LoggerWrapper(threading.Thread):
     """
     Read text message from a pipe and redirect them
@@ -646,6 +1019,14 @@ class PullRequest(object):
         """Return the number of the Pull Request."""
         return self.pull.number
 
+    def has_merge_time(self):
+        """
+        Return whether the Pull Request has a merge time, i.e. is merged.
+        Unlike pull.merged and is_merged, this does not request the API as
+        the merge time is also set on the Pull Requests of a listing.
+        """
+        return self.pull.merged_at is not None
+
     @retry_on_error(retries=SCC_RETRIES)
     def has_issues(self):
         """Check if the base repository has issues enabled."""
@@ -749,6 +1130,7 @@ class GitHubRepository(object):
         self.user_name = user_name
         self.repo_name = repo_name
         self.candidate_pulls = []
+        self.excluded_pulls = {}
         self.candidate_branches = {}
 
         try:
@@ -772,6 +1154,19 @@ class GitHubRepository(object):
     def get_issue(self, *args):
         return self.repo.get_issue(*args)
 
+    def get_lazy_issue(self, number):
+        """
+        Return an issue addressed by number without fetching it, e.g. to
+        edit it with a single request.
+
+        PyGithub has no public lazy issue getter, so the issue is built
+        with the constructor of the PyGithub version pinned in setup.py.
+        """
+        url = "%s/issues/%s" % (self.repo.url, number)
+        return github.Issue.Issue(
+            self.repo._requester, {}, {"number": number, "url": url},
+            completed=False)
+
     @retry_on_error(retries=SCC_RETRIES)
     def get_pulls(self, *args):
         return self.repo.get_pulls(*args)
@@ -793,6 +1188,50 @@ class GitHubRepository(object):
             )
             raise
 
+    @retry_on_error(retries=SCC_RETRIES)
+    def get_pulls_by_number(self, numbers, since=None, jobs=1):
+        """
+        Return a dictionary of the pull requests with the given numbers.
+
+        The closed pull requests are listed in pages by decreasing update
+        time until the listing ends or reaches the pull requests last
+        updated before since. The pull requests still missing are then
+        fetched one by one, using jobs threads.
+        """
+        numbers = set(numbers)
+        pulls = {}
+        for page in itertools.count():
+            # Reading another page costs more requests than fetching the
+            # missing pull requests individually once there are fewer of
+            # them than pages already read
+            if len(numbers) - len(pulls) <= page:
+                break
+            page_pulls = self.get_pulls_page(
+                page, state="closed", sort="updated", direction="desc")
+            # An empty page is past the end of the listing
+            if not page_pulls:
+                break
+            recent = [x for x in page_pulls
+                      if since is None or x.updated_at >= since]
+            pulls.update((x.number, x) for x in recent if x.number in numbers)
+            # The pull requests of the next pages were updated even earlier
+            if len(recent) < len(page_pulls):
+                break
+
+        missing = sorted(numbers.difference(pulls))
+        if missing:
+            self.log.debug("Fetching %s PR(s) individually", len(missing))
+        pulls.update(zip(missing, parallel_map(self.get_pull, missing, jobs)))
+        return pulls
+
+    @retry_on_error(retries=SCC_RETRIES)
+    def get_pulls_page(self, page, **parameters):
+        """
+        Return a page of the pull request listing with the given
+        parameters.
+        """
+        return self.repo.get_pulls(**parameters).get_page(page)
+
     @retry_on_error(retries=SCC_RETRIES)
     def get_milestone(self, name):
 
@@ -807,6 +1246,15 @@ class GitHubRepository(object):
     def get_milestones(self, *args):
         return self.repo.get_milestones(*args)
 
+    @retry_on_error(retries=SCC_RETRIES)
+    def get_label_names(self):
+        """Return the names of all the labels defined on the repository."""
+        return set(x.name for x in self.repo.get_labels())
+
+    @retry_on_error(retries=SCC_RETRIES)
+    def create_label(self, name, color="ededed"):
+        return self.repo.create_label(name, color)
+
     def get_owner(self):
         return self.owner.login
 
@@ -840,7 +1288,7 @@ class GitHubRepository(object):
         # just those actions which don't
         # require a clone.
         repo = "git@github.com:%s/%s.git" % (self.get_owner(), self.repo_name)
-        p = subprocess.Popen(["git", "push", repo, name])
+        p = subprocess.Popen(["git", "push", repo, name], close_fds=True)
         rc = p.wait()
         if rc != 0:
             raise Exception("'git push %s %s' failed", repo, name)
@@ -904,7 +1352,7 @@ class GitHubRepository(object):
 
         # Loop over pull requests opened against base
         pulls = self.get_pulls_by_base(filters["base"])
-        excluded_pulls = {}
+        excluded_pulls = self.excluded_pulls
 
         for pull in pulls:
             pullrequest = PullRequest(pull)
@@ -1016,10 +1464,13 @@ class GitHubRepository(object):
 class GitRepository(object):
 
     def __init__(self, gh, path, remote="origin", push_branch=None,
-                 repository_config=None):
+                 repository_config=None, fetch_options=None):
         """
         Register the git repository path, return the current status and
         register the GitHub origin remote.
+
+        fetch_options is a dictionary of FETCH_OPTIONS used by fetch, see
+        get_fetch_args.
         """
 
         self.log = logging.getLogger("scc.git")
@@ -1049,7 +1500,12 @@ class GitRepository(object):
         if self.repository_config is not None:
             self.dbg("Repository configuration:\n%s" %
                      (yaml.dump(self.repository_config)))
+        self.fetch_options = fetch_options or {}
         self.submodules = []
+        self.candidates_msg = None
+        self.report = MergeReport()
+        self.merge_bases = {}
+        self.pair_changes = {}
         if gh:
             self.origin = gh.gh_repo(repo_name, user_name)
 
@@ -1065,7 +1521,8 @@ class GitRepository(object):
                 try:
                     submodule_repo = \
                         self.gh.git_repo(directory,
-                                         repository_config=repository_config)
+                                         repository_config=repository_config,
+                                         fetch_options=self.fetch_options)
                     self.submodules.append(submodule_repo)
                     submodule_repo.register_submodules()
                 finally:
@@ -1078,10 +1535,16 @@ class GitRepository(object):
 
     def communicate(self, *command, **kwargs):
         return_stderr = kwargs.pop('return_stderr', False)
+        stdin = kwargs.pop('input', None)
         kwargs['no_wait'] = True
+        if stdin is not None:
+            kwargs['stdin'] = subprocess.PIPE
 
         p = self.wrap_call(subprocess.PIPE, *command, **kwargs)
-        o, e = p.communicate()
+        if stdin is not None:
+            o, e = p.communicate(stdin)
+        else:
+            o, e = p.communicate()
         p.stdout.close()
         p.stderr.close()
         if p.returncode:
@@ -1126,9 +1589,12 @@ class GitRepository(object):
         except Exception:
             no_wait = False
 
-        self.cd(self.path)
+        # Commands run from worker threads pass their own directory as the
+        # process-wide working directory is shared by all threads
+        if "cwd" not in kwargs:
+            self.cd(self.path)
         self.dbg("Calling '%s'" % " ".join(command))
-        p = subprocess.Popen(command, **kwargs)
+        p = subprocess.Popen(command, close_fds=True, **kwargs)
         if not no_wait:
             rc = p.wait()
             if rc:
@@ -1233,9 +1699,80 @@ class GitRepository(object):
         self.dbg("Adding remote %s for %s...", name, url)
         self.call("git", "remote", "add", name, url)
 
-    def fetch(self, remote="origin"):
+    def fetch(self, remote="origin", *refspecs):
+        command = ["git", "fetch"] + self.get_fetch_args() + [remote]
+        command.extend(refspecs)
         self.dbg("Fetching remote %s...", remote)
-        self.call("git", "fetch", remote)
+        if not self.log.isEnabledFor(logging.DEBUG):
+            self.call(*command)
+            return
+
+        size = self.get_objects_size()
+        start = time.time()
+        self.call(*command)
+        self.dbg("Fetched %s KiB from %s in %.1f s",
+                 self.get_objects_size() - size, remote, time.time() - start)
+
+    def get_fetch_args(self):
+        """
+        Return the git fetch options of the fetch strategy.
+
+        The options are read from the fetch section of the repository
+        configuration and overridden by the fetch options of the command
+        line: filter (e.g. blob:none for a blob-less partial fetch), depth,
+        shallow-since and negotiation-tip (a list of references).
+        """
+        options = {}
+        if self.repository_config is not None:
+            options.update(self.repository_config.get("fetch") or {})
+        options.update(
+            (k, v) for k, v in self.fetch_options.iteritems() if v)
+
+        fetch_args = []
+        for key in FETCH_OPTIONS:
+            values = options.get(key) or []
+            if not isinstance(values, list):
+                values = [values]
+            fetch_args.extend("--%s=%s" % (key, x) for x in values)
+        return fetch_args
+
+    def get_objects_size(self):
+        """Return the size in KiB of the loose and packed objects"""
+        out = self.communicate("git", "count-objects", "-v")
+        sizes = dict(x.split(": ") for x in out.splitlines())
+        return int(sizes["size"]) + int(sizes["size-pack"])
+
+    def is_shallow(self):
+        out = self.communicate("git", "rev-parse", "--is-shallow-repository")
+        return out.strip() == "true"
+
+    def has_merge_base(self, a, b):
+        try:
+            self.communicate("git", "merge-base", a, b)
+            return True
+        except Exception:
+            return False
+
+    def deepen(self, shas, upstream="HEAD", remotes=("origin",)):
+        """
+        Deepen a shallow repository until each commit has a merge base with
+        upstream. The depth fetched from the remotes is doubled each time
+        until their full history is fetched.
+        """
+        depth = DEEPEN_DEPTH
+        while self.is_shallow():
+            missing = [x for x in shas if not self.has_merge_base(upstream, x)]
+            if not missing:
+                return
+            if depth > DEEPEN_DEPTH * 16:
+                deepen_arg = "--unshallow"
+            else:
+                deepen_arg = "--deepen=%s" % depth
+            self.dbg("%s commit(s) without merge base. Fetching %s...",
+                     len(missing), deepen_arg)
+            for remote in remotes:
+                self.call("git", "fetch", deepen_arg, remote)
+            depth *= 2
 
     @retry_on_error(retries=SCC_RETRIES)
     def push_branch(self, name, remote="origin", force=False):
@@ -1245,6 +1782,11 @@ class GitRepository(object):
         else:
             self.call("git", "push", remote, name)
 
+    def push_branches(self, names, remote="origin"):
+        """Push several branches with a single git push"""
+        self.dbg("Pushing branches %s to %s..." % (", ".join(names), remote))
+        self.call("git", "push", remote, *names)
+
     def delete_local_branch(self, name, force=False):
         self.dbg("Deleting branch %s locally..." % name)
         d_switch = force and "-D" or "-d"
@@ -1280,12 +1822,87 @@ class GitRepository(object):
         self.call_info("git", "rebase", "--onto",
                        "%s" % newbase, "%s" % upstream, "%s" % sha1)
 
+    def abort_rebase(self):
+        self.dbg("Aborting rebase...")
+        self.call("git", "rebase", "--abort")
+
+    def get_commit_time(self, commit):
+        """Return the UTC commit time of a commit as a datetime"""
+        o = self.communicate("git", "log", "-1", "--format=%ct", commit)
+        return datetime.datetime.utcfromtimestamp(int(o.strip()))
+
     def get_rev_list(self, commit):
         """Return first parent revision list for a given commit"""
         args = ["git", "rev-list", "--first-parent", "%s" % commit]
         o = self.communicate(*args)
         return o.splitlines()
 
+    def iter_rev_list(self, commit):
+        """
+        Yield the first parent revision list of a given commit as it is
+        read. The git process is killed if the generator is closed early.
+        """
+        return self.iter_output(
+            "git", "rev-list", "--first-parent", "%s" % commit)
+
+    def iter_log(self, log_format, *args):
+        """Yield the NUL-delimited records of git log as they are read"""
+        return self.iter_output(
+            "git", "log", "-z", "--format=%s" % log_format, *args,
+            separator="\0")
+
+    def iter_output(self, *command, **kwargs):
+        """
+        Yield the records of the output of a command as it is read. The
+        command is killed if the generator is closed early.
+        """
+        separator = kwargs.pop("separator", "\n")
+        p = self.wrap_call(self.debugWrap, *command,
+                           stdout=subprocess.PIPE, no_wait=True)
+        try:
+            pending = ""
+            for chunk in iter(lambda: p.stdout.read(65536), ""):
+                records = (pending + chunk).split(separator)
+                pending = records.pop()
+                for record in records:
+                    yield record
+            if pending:
+                yield pending
+            if p.wait():
+                raise Exception("Failed to run '%s'" % " ".join(command))
+        finally:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+            p.stdout.close()
+
+    def get_notes(self, refs):
+        """
+        Return a dictionary of the notes of each notes reference, keyed by
+        annotated object. The notes are listed with one git notes list per
+        reference and read with a single git cat-file process.
+        """
+        listed = []
+        for ref in refs:
+            out = self.communicate("git", "notes", "--ref", ref, "list")
+            listed.append([line.split() for line in out.splitlines()])
+
+        blobs = sorted(set(blob for notes in listed for blob, obj in notes))
+        contents = {}
+        if blobs:
+            out = self.communicate(
+                "git", "cat-file", "--batch",
+                input="".join(x + "\n" for x in blobs))
+            start = 0
+            for blob in blobs:
+                end = out.index("\n", start)
+                size = int(out[start:end].split()[2])
+                contents[blob] = out[end + 1:end + 1 + size]
+                start = end + size + 2
+
+        return [dict((obj, contents[blob]) for blob, obj in notes)
+                for notes in listed]
+
     def has_local_changes(self):
         """Check for local changes in the Git repository"""
         out = self.communicate("git", "status", "--porcelain").strip()
@@ -1424,11 +2041,85 @@ class GitRepository(object):
         files = set(files.split("\n")[:-1])
         return files
 
+    def list_merged_files_batch(self, shas, upstream):
+        """
+        Return a dictionary of the files modified by each commit since it
+        branched from upstream, along with the files modified in upstream
+        since then so that list_upstream_changes can reuse them.
+
+        upstream and shas must be SHA1s. Merge bases are cached by pair of
+        commits and all the diffs are computed by list_changes.
+        """
+        pairs = []
+        for sha in shas:
+            common_base = self.get_merge_base(upstream, sha)
+            pairs += [(common_base, sha), (common_base, upstream)]
+        changes = self.list_changes(pairs)
+        return dict(zip(shas, changes[::2]))
+
+    def get_merge_base(self, a, b):
+        """Return the merge base of two SHA1s, cached by pair of commits"""
+        if (a, b) not in self.merge_bases:
+            self.merge_bases[(a, b)] = self.merge_base(a, b).split("\n")[0]
+        return self.merge_bases[(a, b)]
+
+    def list_changes(self, pairs):
+        """
+        Return the sets of files modified between each (base, head) pair of
+        SHA1s.
+
+        The trees of the commits are resolved with a single git cat-file
+        process and all the pairs of trees are compared with a single
+        git diff-tree process. Results are cached by pair of commits.
+        """
+        missing = []
+        for pair in pairs:
+            if pair not in self.pair_changes and pair not in missing:
+                missing.append(pair)
+
+        if missing:
+            trees = self.get_trees(set(x for pair in missing for x in pair))
+            headers = ["%s %s" % (trees[a], trees[b]) for a, b in missing]
+            out = self.communicate(
+                "git", "diff-tree", "--stdin", "-r", "--name-only",
+                input="".join(x + "\n" for x in headers))
+            # diff-tree echoes each input line before the modified paths
+            current = -1
+            files = [set() for x in missing]
+            for line in out.split("\n")[:-1]:
+                if current + 1 < len(headers) and \
+                        line == headers[current + 1]:
+                    current += 1
+                else:
+                    files[current].add(line)
+            self.pair_changes.update(zip(missing, files))
+
+        return [self.pair_changes[pair] for pair in pairs]
+
+    def get_trees(self, shas):
+        """Return a dictionary of the tree of each commit"""
+        shas = list(shas)
+        out = self.communicate(
+            "git", "cat-file", "--batch-check",
+            input="".join("%s^{tree}\n" % x for x in shas))
+        trees = {}
+        for sha, line in zip(shas, out.split("\n")):
+            if not line.endswith(" missing"):
+                trees[sha] = line.split(" ")[0]
+            else:
+                raise Exception("Failed to find the tree of %s" % sha)
+        return trees
+
     def list_upstream_changes(self, sha, upstream="HEAD"):
         """
         Return a list of files modified in parent since this PR was branched,
         suggesting a rebase may be necessary.
         """
+        if (upstream, sha) in self.merge_bases:
+            # Cached by list_merged_files_batch
+            common_base = self.merge_bases[(upstream, sha)]
+            return self.list_changes([(common_base, upstream)])[0]
+
         mrg = self.merge_base(upstream, sha)
         common_base = mrg.split("\n")[0]
 
@@ -1444,7 +2135,8 @@ class GitRepository(object):
         which modify the same file.
 
         conflict_files: A list of conflicting files
-        changed_files: A dictionary of (PullRequest, [changed-filenames])
+        changed_files: A ChangedFiles index of the files changed by each
+          PullRequest
         upstream: The SHA1 of the upstream branch before any other PRs were
           merged, required to detect if a rebase might be needed
         """
@@ -1455,29 +2147,27 @@ class GitRepository(object):
 
         pull_changed = set()
         for cf in conflict_files:
-            if cf in changed_files[pull]:
-                pull_changed.add(cf)
-            else:
+            pulls = changed_files.find(cf)
+            if pull not in pulls:
                 # Uncommitted changes in working directory
-                try:
-                    conflicts[None].append(cf)
-                except KeyError:
-                    conflicts[None] = [cf]
+                conflicts.setdefault(None, []).append(cf)
+                continue
+
+            pull_changed.add(cf)
+            for pr in pulls:
+                if pr != pull:
+                    conflicts.setdefault(pr, set()).add(cf)
 
         if upstream:
             upstream_changes = self.list_upstream_changes(
                 pull.get_sha(), upstream=upstream)
             upstream_conflicts = pull_changed.intersection(upstream_changes)
 
-        for (pr, changed) in changed_files.iteritems():
-            if pr != pull:
-                both_changed = pull_changed.intersection(changed)
-                if both_changed:
-                    conflicts[pr] = both_changed
         return conflicts, upstream_conflicts
 
     def safe_merge(self, sha, message):
         """Merge a branch and revert to current HEAD in case of conflict.
+        sha can be a list of commits to create an octopus merge.
         Returns: [] if the merge succeeded
                  list of conflicting paths if it failed
                  [None] if it failed and conflict detection also failed
@@ -1485,8 +2175,13 @@ class GitRepository(object):
         premerge_sha = self.communicate("git", "rev-parse", "HEAD")
         premerge_sha = premerge_sha.rstrip("\n")
 
+        if isinstance(sha, list):
+            shas = sha
+        else:
+            shas = [sha]
+
         try:
-            self.call("git", "merge", "--no-ff", "-m", message, sha)
+            self.call("git", "merge", "--no-ff", "-m", message, *shas)
             return []
         except Exception:
             try:
@@ -1501,36 +2196,258 @@ class GitRepository(object):
                 self.call("git", "reset", "--hard", "%s" % premerge_sha)
 
     def merge(self, comment=False, commit_id="merge",
-              set_commit_status=False):
+              set_commit_status=False, incremental=None, batch=False,
+              jobs=1):
         """Merge candidate pull requests and pull requests."""
         self.dbg("## Unique users: %s", self.unique_logins())
         for key, url in self.get_merge_remotes().items():
-            self.call("git", "remote", "add", key, url)
-            self.fetch(key)
+            with self.report.timed("fetch", repo=self.get_name(),
+                                   remote=key):
+                self.call("git", "remote", "add", key, url)
+                self.fetch(key)
+        self.deepen([x.get_sha() for x in self.origin.candidate_pulls],
+                    remotes=[self.remote] + self.get_merge_remotes().keys())
+
+        merged_pulls, conflicting_pulls = self.merge_pulls(
+            comment=comment, commit_id=commit_id, incremental=incremental,
+            batch=batch, jobs=jobs)
+        merged_branches, conflicting_branches = self.merge_branches(
+            commit_id=commit_id)
+
+        def pulls(pullrequests):
+            return [{"pull": x.get_number(), "login": x.get_login(),
+                     "title": x.get_title()} for x in pullrequests]
+
+        merge_msg = self.log_merge(self.report.emit(
+            "merged", repo=self.get_name(),
+            merged_pulls=pulls(merged_pulls),
+            conflicting_pulls=pulls(conflicting_pulls),
+            merged_branches=merged_branches,
+            conflicting_branches=conflicting_branches))
+
+        if set_commit_status and get_token():
+            conflict = len(conflicting_branches) or len(conflicting_pulls)
+            status = 'failure' if conflict else 'success'
+            success_msg = 'Not all current branches/PRs can be merged.'
+            conflict_msg = 'All current PRs/branches can be merged.'
+            message = conflict_msg if conflict else success_msg
+            url = BUILD_URL if IS_JENKINS_JOB else github.GithubObject.NotSet
+            merge_msg += self.set_commit_status(status, message, url)
+
+        self.call("git", "submodule", "update")
+        return merge_msg
+
+    def merge_pulls(self, comment=False, commit_id="merge", incremental=None,
+                    batch=False, jobs=1):
+        """
+        Merge the candidate pull requests in order.
+
+        If incremental is set, the leading merge commits of this reference
+        which merged the current head of the first candidate pull requests
+        are reused and only the remaining pull requests are merged.
 
+        If jobs is greater than 1, each pull request is first trial-merged
+        on its own against the base using that many worktrees in parallel,
+        see trial_merge_pulls. The pull requests conflicting with the base
+        are reported without being merged again unless earlier pull
+        requests were merged, in which case their merge is retried as in
+        the sequential path.
+
+        If batch is set, the pull requests are merged using octopus merges
+        of groups of pull requests, see merge_pulls_batch.
+
+        Returns: (merged pull requests, conflicting pull requests)
+        """
         upstream_sha = self.get_current_sha1()
-        changed_files = {}
+        changed_files = ChangedFiles()
 
         conflicting_pulls = []
         merged_pulls = []
-        conflicting_branches = []
-        merged_branches = []
 
-        for pullrequest in self.origin.candidate_pulls:
-            # Compare current PR against the list of PRs merged so far
-            # (An alternative would be to compare against pre-merge by
-            # passing upstream_sha as the second of list_merged_files)
-            files = self.list_merged_files(pullrequest.get_sha())
-            changed_files[pullrequest] = files
-
-            merge_status = self.merge_pull(
-                pullrequest, comment=comment, commit_id=commit_id,
-                all_changed_files=changed_files, upstream=upstream_sha)
+        candidate_pulls = self.origin.candidate_pulls
+        if incremental:
+            reused = self.reuse_merge_prefix(incremental, commit_id=commit_id)
+            for pullrequest, premerge_sha in reused:
+                changed_files[pullrequest] = self.list_merged_files_batch(
+                    [pullrequest.get_sha()], premerge_sha).values()[0]
+                self.pull_merged(pullrequest, comment=comment)
+                merged_pulls.append(pullrequest)
+            candidate_pulls = candidate_pulls[len(reused):]
+
+        # Compare all the remaining PRs against pre-merge at once
+        merged_files = self.list_merged_files_batch(
+            [x.get_sha() for x in candidate_pulls], upstream_sha)
+        pulls_files = dict((x, merged_files[x.get_sha()])
+                           for x in candidate_pulls)
+
+        trial_conflicts = {}
+        if jobs > 1 and len(candidate_pulls) > 1:
+            trial_conflicts = self.trial_merge_pulls(
+                candidate_pulls, upstream_sha, jobs)
+
+        batch_statuses = {}
+        group = [x for x in candidate_pulls if x not in trial_conflicts]
+        if batch and group:
+            batch_statuses = dict(zip(group, self.merge_pulls_batch(
+                group, comment=comment, commit_id=commit_id,
+                all_changed_files=changed_files, upstream=upstream_sha,
+                group_files=pulls_files)))
+
+        for pullrequest in candidate_pulls:
+            if pullrequest in batch_statuses:
+                merge_status = batch_statuses[pullrequest]
+            else:
+                changed_files[pullrequest] = pulls_files[pullrequest]
+                # A trial merge against the base says nothing about the
+                # merge on top of earlier pull requests, e.g. of a pull
+                # request depending on one of them
+                conflict_files = None
+                if not merged_pulls:
+                    conflict_files = trial_conflicts.get(pullrequest)
+                merge_status = self.merge_pull(
+                    pullrequest, comment=comment, commit_id=commit_id,
+                    all_changed_files=changed_files, upstream=upstream_sha,
+                    conflict_files=conflict_files)
             if merge_status:
                 merged_pulls.append(pullrequest)
             else:
                 conflicting_pulls.append(pullrequest)
 
+        return merged_pulls, conflicting_pulls
+
+    def trial_merge_pulls(self, pulls, upstream, jobs):
+        """
+        Merge each pull request on its own into upstream without committing.
+
+        The trial merges run in parallel in a pool of worktrees sharing the
+        object store of this repository, so that the current checkout is
+        left untouched.
+
+        Returns: dictionary of the conflicting paths of the pull requests
+        which cannot be merged into upstream
+        """
+        jobs = min(jobs, len(pulls))
+        with self.report.timed("trial", repo=self.get_name(),
+                               jobs=jobs) as fields:
+            with self.worktrees(jobs, upstream) as pool:
+
+                def trial_merge(pullrequest):
+                    worktree = pool.get()
+                    try:
+                        return self.trial_merge(
+                            pullrequest.get_sha(), worktree)
+                    finally:
+                        pool.put(worktree)
+
+                conflicts = parallel_map(trial_merge, pulls, jobs)
+            fields["conflicting"] = [
+                x.get_number() for x, y in zip(pulls, conflicts) if y]
+        self.dbg("Trial merges of %s PRs: %s conflicting",
+                 len(pulls), len(fields["conflicting"]))
+        return dict((x, y) for x, y in zip(pulls, conflicts) if y)
+
+    @contextlib.contextmanager
+    def worktrees(self, count, head):
+        """
+        Create a pool of detached worktrees checked out at head and
+        remove them on exit. Yields a queue of the worktree paths.
+        """
+        pool = Queue.Queue()
+        paths = []
+        try:
+            for i in range(count):
+                paths.append(tempfile.mkdtemp(prefix="scc-worktree-"))
+                self.call("git", "worktree", "add", "--detach", paths[-1],
+                          head)
+                pool.put(paths[-1])
+            yield pool
+        finally:
+            for path in paths:
+                shutil.rmtree(path, ignore_errors=True)
+            self.call("git", "worktree", "prune")
+
+    def trial_merge(self, sha, worktree):
+        """
+        Merge a commit without committing in a worktree and reset it.
+
+        Returns: [] if the merge succeeded
+                 list of conflicting paths if it failed
+                 [None] if it failed and conflict detection also failed
+        """
+        try:
+            self.call("git", "merge", "--no-commit", "--no-ff", sha,
+                      cwd=worktree)
+            return []
+        except Exception:
+            conflicts = self.communicate(
+                "git", "diff", "--name-only", "--diff-filter=U",
+                cwd=worktree)
+            return [c for c in conflicts.split('\n') if c] or [None]
+        finally:
+            self.call("git", "reset", "--hard", "--quiet", cwd=worktree)
+
+    def merge_pulls_batch(self, pulls, comment=False, commit_id="merge",
+                          all_changed_files=None, upstream=None,
+                          group_files=None):
+        """
+        Merge a group of pull requests using a single octopus merge.
+
+        If the octopus merge fails, the group is bisected and both halves
+        are merged in turn until the conflicting pull requests are merged
+        on their own with merge_pull. Pull requests are processed in order
+        so the merged and conflicting pull requests are the same as when
+        merging them one by one.
+
+        Returns: list of merge statuses
+        """
+        if group_files is None:
+            group_files = {}
+        for pullrequest in pulls:
+            if pullrequest not in group_files:
+                group_files[pullrequest] = self.list_merged_files(
+                    pullrequest.get_sha())
+
+        if len(pulls) == 1:
+            all_changed_files[pulls[0]] = group_files[pulls[0]]
+            return [self.merge_pull(
+                pulls[0], comment=comment, commit_id=commit_id,
+                all_changed_files=all_changed_files, upstream=upstream)]
+
+        commit_msg = "%s: PRs %s\n\n%s" % (
+            commit_id, ", ".join(str(x.get_number()) for x in pulls),
+            "\n".join("PR %s (%s)" % (x.get_number(), x.get_title())
+                      for x in pulls))
+        self.dbg("Trying octopus merge of %s PRs", len(pulls))
+        with self.report.timed(
+                "merge", repo=self.get_name(),
+                pulls=[x.get_number() for x in pulls]) as fields:
+            conflict_files = self.safe_merge(
+                [x.get_sha() for x in pulls], commit_msg)
+            fields["merged"] = not conflict_files
+        if not conflict_files:
+            for pullrequest in pulls:
+                all_changed_files[pullrequest] = group_files[pullrequest]
+                self.pull_merged(pullrequest, comment=comment)
+            return [True] * len(pulls)
+
+        half = len(pulls) // 2
+        statuses = []
+        for group in (pulls[:half], pulls[half:]):
+            statuses += self.merge_pulls_batch(
+                group, comment=comment, commit_id=commit_id,
+                all_changed_files=all_changed_files, upstream=upstream,
+                group_files=group_files)
+        return statuses
+
+    def merge_branches(self, commit_id="merge"):
+        """
+        Merge the candidate branches.
+
+        Returns: (merged branches, conflicting branches)
+        """
+        conflicting_branches = []
+        merged_branches = []
+
         for remote, repo_branches in \
                 self.origin.candidate_branches.iteritems():
             # repo = repo_branches[0]
@@ -1543,48 +2460,100 @@ class GitRepository(object):
                     conflicting_branches.append(
                         '%s:%s' % (remote, branch_name))
 
-        merge_msg = self.log_merge(merged_pulls, merged_branches,
-                                   conflicting_pulls, conflicting_branches)
+        return merged_branches, conflicting_branches
 
-        if set_commit_status and get_token():
-            conflict = len(conflicting_branches) or len(conflicting_pulls)
-            status = 'failure' if conflict else 'success'
-            success_msg = 'Not all current branches/PRs can be merged.'
-            conflict_msg = 'All current PRs/branches can be merged.'
-            message = conflict_msg if conflict else success_msg
-            url = BUILD_URL if IS_JENKINS_JOB else github.GithubObject.NotSet
-            merge_msg += self.set_commit_status(status, message, url)
+    def find_merge_prefix(self, ref, commit_id="merge"):
+        """
+        Find the candidate pull requests already merged by a previous merge.
+
+        Walk the first-parent history of ref from the current HEAD and match
+        each merge commit against the candidate pull requests in order. The
+        walk stops at the first commit which is not a merge of the current
+        head SHA1 of the next candidate pull request(s). Octopus merges
+        created by batch merging match as many pull requests as they have
+        merged heads.
+
+        Returns: list of (PullRequest, pre-merge SHA1, merge SHA1)
+        """
+        try:
+            ref_sha = self.communicate(
+                "git", "rev-parse", "--verify", "--quiet",
+                "%s^{commit}" % ref).strip()
+        except Exception:
+            self.info("Cannot resolve %s. Merging all PRs", ref)
+            return []
+
+        parent = self.get_current_sha1()
+        out = self.communicate(
+            "git", "log", "--first-parent", "--reverse",
+            "--format=%H %P%x09%s",
+            "%s..%s" % (parent, ref_sha))
+
+        prefix = []
+        pulls = self.origin.candidate_pulls
+        for line in out.splitlines():
+            shas, subject = line.split("\t", 1)
+            shas = shas.split()
+            heads = shas[2:]
+            merged = pulls[len(prefix):len(prefix) + len(heads)]
+            if not heads or shas[1] != parent or \
+                    [x.get_sha() for x in merged] != heads or \
+                    not subject.startswith("%s: PR" % commit_id):
+                break
+            prefix.extend((x, parent, shas[0]) for x in merged)
+            parent = shas[0]
+        return prefix
+
+    def reuse_merge_prefix(self, ref, commit_id="merge"):
+        """
+        Fast-forward to the last merge commit of ref which can be reused.
+
+        Returns: list of (PullRequest, pre-merge SHA1) for the reused PRs
+        """
+        prefix = self.find_merge_prefix(ref, commit_id=commit_id)
+        if not prefix:
+            self.info("No merge commit reused from %s", ref)
+            return []
 
-        self.call("git", "submodule", "update")
-        return merge_msg
+        self.info("Reusing %s merged PR(s) from %s", len(prefix), ref)
+        self.call("git", "merge", "--ff-only", prefix[-1][2])
+        return [(pullrequest, premerge_sha)
+                for pullrequest, premerge_sha, merge_sha in prefix]
 
-    def log_merge(self, merged_pulls, merged_branches, conflicting_pulls,
-                  conflicting_branches):
+    def log_merge(self, record):
+        """Render the text summary of a merged event record"""
+
+        def pull_line(pull):
+            return (u"  # PR %s %s '%s'" % (
+                pull["pull"], pull["login"], pull["title"])).encode('utf-8')
 
         merge_msgs = []
 
-        if merged_pulls:
+        if record["merged_pulls"]:
             merge_msg = "Merged PRs:\n"
-            merge_msg += "\n".join([str(x) for x in merged_pulls])
+            merge_msg += "\n".join(
+                [pull_line(x) for x in record["merged_pulls"]])
             merge_msg += "\n"
             merge_msgs.append(merge_msg)
 
-        if merged_branches:
+        if record["merged_branches"]:
             merge_msg = "Merged branches:\n"
-            merge_msg += "\n".join(["  # %s\n" % x for x in merged_branches])
+            merge_msg += "\n".join(
+                ["  # %s\n" % x for x in record["merged_branches"]])
             merge_msg += "\n"
             merge_msgs.append(merge_msg)
 
-        if conflicting_pulls:
+        if record["conflicting_pulls"]:
             merge_msg = "Conflicting PRs (not included):\n"
-            merge_msg += "\n".join([str(x) for x in conflicting_pulls])
+            merge_msg += "\n".join(
+                [pull_line(x) for x in record["conflicting_pulls"]])
             merge_msg += "\n"
             merge_msgs.append(merge_msg)
 
-        if conflicting_branches:
+        if record["conflicting_branches"]:
             merge_msg = "Conflicting branches (not included):\n"
             merge_msg += "\n".join(["  # %s\n" % x for x in
-                                    conflicting_branches])
+                                    record["conflicting_branches"]])
             merge_msg += "\n"
             merge_msgs.append(merge_msg)
 
@@ -1612,45 +2581,82 @@ class GitRepository(object):
                 '\n'.join('    - %s' % f for f in upstream_conflicts)
         return conflict_msg
 
-    def merge_pull(self, pullrequest, comment=False, commit_id="merge",
-                   all_changed_files=None, upstream=None):
-        """Merge pull request."""
-
-        commit_msg = "%s: PR %s (%s)" % (
-            commit_id, pullrequest.get_number(), pullrequest.get_title())
-        conflict_files = self.safe_merge(pullrequest.get_sha(), commit_msg)
-        previous_conflict_status = pullrequest.get_conflict_status(
-            self.gh.get_login())
-
-        if IS_JENKINS_JOB:
-            build_msg = (
-                "build [%s#%s](%s). "
+    def get_build_msg(self):
+        """Return a description of the current Jenkins build"""
+        return ("build [%s#%s](%s). "
                 "See the [console output](%s) for more details."
                 % (JOB_NAME, BUILD_NUMBER, BUILD_URL,
                    BUILD_URL + "consoleText"))
 
+    def merge_pull(self, pullrequest, comment=False, commit_id="merge",
+                   all_changed_files=None, upstream=None,
+                   conflict_files=None):
+        """
+        Merge pull request.
+
+        If conflict_files is set, the pull request is already known to
+        conflict on these paths, e.g. from a trial merge, and is only
+        reported as conflicting.
+        """
+
+        if not conflict_files:
+            commit_msg = "%s: PR %s (%s)" % (
+                commit_id, pullrequest.get_number(), pullrequest.get_title())
+            with self.report.timed(
+                    "merge", repo=self.get_name(),
+                    pulls=[pullrequest.get_number()]) as fields:
+                conflict_files = self.safe_merge(
+                    pullrequest.get_sha(), commit_msg)
+                fields["merged"] = not conflict_files
+
         if not conflict_files:
-            if not pullrequest.body and comment and get_token():
-                self.dbg("Adding comment to Pull Request #%g."
-                         % pullrequest.get_number())
-                pullrequest.create_issue_comment(EMPTY_MSG)
-            if previous_conflict_status:
-                # Resolve both PR_IS_CONFLICTING and PR_WAS_CONFLICTING
-                self.dbg("Resolving previous conflict on Pull Request #%g."
-                         % pullrequest.get_number())
-                merged_msg = "Conflict resolved"
-                if IS_JENKINS_JOB:
-                    merged_msg += " in %s" % build_msg
-                pullrequest.resolve_conflict_status(
-                    self.gh.get_login(), merged_msg)
+            self.pull_merged(pullrequest, comment=comment)
             return True
 
+        self.pull_conflicting(
+            pullrequest, conflict_files, comment=comment,
+            all_changed_files=all_changed_files, upstream=upstream)
+        return False
+
+    def pull_merged(self, pullrequest, comment=False):
+        """Update a pull request which was successfully merged."""
+
+        previous_conflict_status = pullrequest.get_conflict_status(
+            self.gh.get_login())
+        if not pullrequest.body and comment and get_token():
+            self.dbg("Adding comment to Pull Request #%g."
+                     % pullrequest.get_number())
+            pullrequest.create_issue_comment(EMPTY_MSG)
+        if previous_conflict_status:
+            # Resolve both PR_IS_CONFLICTING and PR_WAS_CONFLICTING
+            self.dbg("Resolving previous conflict on Pull Request #%g."
+                     % pullrequest.get_number())
+            merged_msg = "Conflict resolved"
+            if IS_JENKINS_JOB:
+                merged_msg += " in %s" % self.get_build_msg()
+            pullrequest.resolve_conflict_status(
+                self.gh.get_login(), merged_msg)
+
+    def pull_conflicting(self, pullrequest, conflict_files, comment=False,
+                         all_changed_files=None, upstream=None):
+        """Report the conflicts of a pull request which failed to merge."""
+
+        previous_conflict_status = pullrequest.get_conflict_status(
+            self.gh.get_login())
         conflict_msg = "Conflicting PR."
         if IS_JENKINS_JOB:
-            conflict_msg += " Removed from %s" % build_msg
-
-        conflicts, upstream_conflicts = self.get_possible_conflicts(
-            pullrequest, conflict_files, all_changed_files, upstream)
+            conflict_msg += " Removed from %s" % self.get_build_msg()
+
+        with self.report.timed(
+                "conflicts", repo=self.get_name(),
+                pull=pullrequest.get_number(),
+                files=[x for x in conflict_files if x is not None]) as fields:
+            conflicts, upstream_conflicts = self.get_possible_conflicts(
+                pullrequest, conflict_files, all_changed_files, upstream)
+            fields["pulls"] = dict(
+                (pr.get_number() if pr else None, sorted(files))
+                for pr, files in conflicts.iteritems())
+            fields["upstream"] = sorted(upstream_conflicts or [])
         conflict_msg += self.get_conflicts_message(
             conflicts, upstream_conflicts)
 
@@ -1666,7 +2672,6 @@ class GitRepository(object):
                 self.dbg("Adding comment to issue #%g.",
                          pullrequest.get_number())
                 pullrequest.create_issue_comment(conflict_msg)
-        return False
 
     def merge_branch(self, remote, branch_name, commit_id="merge"):
         """Merge branch."""
@@ -1681,7 +2686,12 @@ class GitRepository(object):
             return False
 
         commit_msg = "%s: branch %s:%s" % (commit_id, remote, branch_name)
-        conflict_files = self.safe_merge(ref, commit_msg)
+        with self.report.timed(
+                "merge", repo=self.get_name(),
+                branch="%s:%s" % (remote, branch_name)) as fields:
+            conflict_files = self.safe_merge(ref, commit_msg)
+            fields["merged"] = not conflict_files
+            fields["files"] = [x for x in conflict_files if x is not None]
 
         if not conflict_files:
             return True
@@ -1704,16 +2714,35 @@ class GitRepository(object):
         return msg
 
     def find_branching_point(self, topic_branch, main_branch):
-        topic_revlist = self.get_rev_list(topic_branch)
-        main_revlist = self.get_rev_list(main_branch)
+        """
+        Return the first commit of the first-parent history of main_branch
+        which is also in the first-parent history of topic_branch.
 
-        # Compare sequences
-        s = difflib.SequenceMatcher(None, topic_revlist, main_revlist)
-        matching_block = s.get_matching_blocks()
-        if matching_block[0].size == 0:
-            raise Exception("No matching block found")
+        Both histories are walked lazily and in alternation so that only
+        the commits down to the branching point are read.
+        """
+        walks = [self.iter_rev_list(topic_branch),
+                 self.iter_rev_list(main_branch)]
+        seen = [set(), set()]
+        sha1 = None
+        try:
+            active = [0, 1]
+            while active and sha1 is None:
+                for i in list(active):
+                    commit = next(walks[i], None)
+                    if commit is None:
+                        active.remove(i)
+                    elif commit in seen[1 - i]:
+                        sha1 = commit
+                        break
+                    else:
+                        seen[i].add(commit)
+        finally:
+            for walk in walks:
+                walk.close()
 
-        sha1 = main_revlist[matching_block[0].b]
+        if sha1 is None:
+            raise Exception("No matching block found")
         self.info("Branching SHA1: %s" % sha1[0:6])
         return sha1
 
@@ -1751,23 +2780,24 @@ class GitRepository(object):
 
     def rmerge(self, filters, info=False, comment=False, commit_id="merge",
                top_message=None, update_gitmodules=False,
-               set_commit_status=False, allow_empty=True, is_submodule=False):
-        """Recursively merge PRs for each submodule."""
+               set_commit_status=False, allow_empty=True, is_submodule=False,
+               incremental=None, fingerprint=None, batch=False,
+               report=None, jobs=1):
+        """
+        Recursively merge PRs for each submodule.
 
-        if self.repository_config is not None and \
-           "base-branch" in self.repository_config and \
-           filters["base"] != self.repository_config["base-branch"]:
-            self.log.info("Overriding base-branch from %s to %s" %
-                          (filters["base"],
-                           self.repository_config["base-branch"]))
-            filters["base"] = self.repository_config["base-branch"]
+        If report is set, the merge events of all the repositories are
+        emitted to this MergeReport as they happen.
+        """
+
+        if report is not None:
+            self.report = report
+        self.apply_repository_config(filters)
 
         updated = False
         merge_msg = ""
         merge_msg += str(self.origin) + "\n"
-        merge_msg += self.origin.find_candidate_pulls(filters)
-        self.origin.find_candidate_branches(
-            filters, fork_filter=self.get_fork_filter(is_submodule))
+        merge_msg += self.find_candidates(filters, is_submodule=is_submodule)
         if info:
             merge_msg += self.origin.merge_info()
         else:
@@ -1790,37 +2820,162 @@ class GitRepository(object):
                 merge_msg += '\n'
 
             merge_msg += self.merge(comment, commit_id=commit_id,
-                                    set_commit_status=set_commit_status)
+                                    set_commit_status=set_commit_status,
+                                    incremental=incremental, batch=batch,
+                                    jobs=jobs)
             postsha1 = self.get_current_sha1()
             updated = (presha1 != postsha1)
 
         for submodule_repo in self.submodules:
-            # Create submodule filters
-            sub_filters = copy.deepcopy(filters)
-            # Do not copy top-level PRs
-            for ftype in ["include", "exclude"]:
-                sub_filters[ftype].pop("pr", None)
+            sub_filters = self.get_submodule_filters(filters)
             try:
                 submodule_updated, submodule_msg = submodule_repo.rmerge(
                     sub_filters, info, comment, commit_id=commit_id,
                     update_gitmodules=update_gitmodules,
                     set_commit_status=set_commit_status,
-                    allow_empty=allow_empty, is_submodule=True)
+                    allow_empty=allow_empty, is_submodule=True,
+                    incremental=incremental, batch=batch,
+                    report=self.report, jobs=jobs)
                 merge_msg += "\n" + submodule_msg
             finally:
                 self.cd(self.path)
 
         if not info:
-            summary_update = self.summary_commit(
-                merge_msg, commit_id=commit_id, top_message=top_message,
-                update_gitmodules=update_gitmodules, allow_empty=allow_empty)
+            with self.report.timed("summary",
+                                   repo=self.get_name()) as fields:
+                summary_update = self.summary_commit(
+                    merge_msg, commit_id=commit_id, top_message=top_message,
+                    update_gitmodules=update_gitmodules,
+                    allow_empty=allow_empty, fingerprint=fingerprint)
+                fields["updated"] = summary_update or updated
+                fields["sha"] = self.get_current_sha1()
             if summary_update:
                 updated = True
 
         return updated, merge_msg
 
+    def apply_repository_config(self, filters):
+        """Override the base branch using the repository configuration"""
+
+        if self.repository_config is not None and \
+           "base-branch" in self.repository_config and \
+           filters["base"] != self.repository_config["base-branch"]:
+            self.log.info("Overriding base-branch from %s to %s" %
+                          (filters["base"],
+                           self.repository_config["base-branch"]))
+            filters["base"] = self.repository_config["base-branch"]
+
+    def find_candidates(self, filters, is_submodule=False):
+        """
+        Find the candidate PRs and branches of the origin repository.
+
+        The candidates are only looked up once so that they can be
+        inspected before merging. Returns the message listing the
+        excluded PRs.
+        """
+
+        if self.candidates_msg is None:
+            with self.report.timed("filter", repo=self.get_name()) as fields:
+                self.candidates_msg = self.origin.find_candidate_pulls(
+                    filters)
+                self.origin.find_candidate_branches(
+                    filters, fork_filter=self.get_fork_filter(is_submodule))
+                fields["pulls"] = [
+                    {"pull": x.get_number(), "sha": x.get_sha()}
+                    for x in self.origin.candidate_pulls]
+                fields["excluded"] = [
+                    {"pull": x.get_number(), "reason": reason}
+                    for x, reason in self.origin.excluded_pulls.iteritems()]
+                fields["branches"] = [
+                    "%s:%s" % (remote, name) for remote, repo_branches in
+                    self.origin.candidate_branches.iteritems()
+                    for name in repo_branches[1]]
+        return self.candidates_msg
+
+    def get_name(self):
+        """Return the user/name of the origin repository"""
+        return "%s/%s" % (self.origin.user_name, self.origin.repo_name)
+
+    def get_submodule_filters(self, filters):
+        """Create submodule filters from the filters of this repository"""
+
+        sub_filters = copy.deepcopy(filters)
+        # Do not copy top-level PRs
+        for ftype in ["include", "exclude"]:
+            sub_filters[ftype].pop("pr", None)
+        return sub_filters
+
+    def rfingerprint(self, filters, options=None):
+        """
+        Return a fingerprint of the inputs of a recursive merge.
+
+        The fingerprint is the SHA1 digest of the filters and options, the
+        SHA1s of the HEAD and base branch of each repository and the head
+        SHA1s of the candidate PRs and branches. It is computed without
+        modifying any of the repositories.
+        """
+
+        digest = hashlib.sha1()
+        digest.update(json.dumps([filters, options], sort_keys=True))
+        self.update_fingerprint(digest, filters)
+        return digest.hexdigest()
+
+    def update_fingerprint(self, digest, filters, is_submodule=False):
+        """Recursively add the merge inputs to the fingerprint digest"""
+
+        self.apply_repository_config(filters)
+        self.find_candidates(filters, is_submodule=is_submodule)
+
+        inputs = [str(self.origin), self.get_current_sha1()]
+        if self.has_remote_branch(filters["base"], self.remote):
+            inputs.append(
+                self.get_sha1("%s/%s" % (self.remote, filters["base"])))
+        for pullrequest in self.origin.candidate_pulls:
+            inputs.append("PR %s %s" % (pullrequest.get_number(),
+                                        pullrequest.get_sha()))
+        for remote, repo_branches in \
+                sorted(self.origin.candidate_branches.iteritems()):
+            for branch_name in repo_branches[1]:
+                branch = repo_branches[0].get_branch(branch_name)
+                inputs.append("branch %s:%s %s" % (
+                    remote, branch_name, branch.commit.sha))
+        digest.update("\n".join(inputs) + "\n")
+
+        for submodule_repo in self.submodules:
+            try:
+                submodule_repo.update_fingerprint(
+                    digest, self.get_submodule_filters(filters),
+                    is_submodule=True)
+            finally:
+                self.cd(self.path)
+
+    def get_fingerprint(self, url, branch):
+        """
+        Return the fingerprint recorded in the commit message of the head of
+        a remote branch or None if the branch or the fingerprint is missing.
+        """
+
+        try:
+            out = self.communicate(
+                "git", "ls-remote", url, "refs/heads/%s" % branch)
+        except Exception:
+            self.dbg("Failed to list %s", url, exc_info=1)
+            return None
+        if not out.strip():
+            return None
+        sha1 = out.split()[0]
+        if not self.has_local_object(sha1):
+            self.fetch(url, "refs/heads/%s" % branch)
+        message = self.communicate("git", "log", "-1", "--format=%B", sha1)
+        pattern = r'^%s ([0-9a-f]{40})$' % FINGERPRINT_TRAILER
+        m = re.search(pattern, message, re.MULTILINE)
+        if m is None:
+            return None
+        return m.group(1)
+
     def summary_commit(self, merge_msg, commit_id="merge", top_message=None,
-                       update_gitmodules=False, allow_empty=True):
+                       update_gitmodules=False, allow_empty=True,
+                       fingerprint=None):
         """Create a top-level summary commit bumping the submodules"""
 
         if IS_JENKINS_JOB:
@@ -1828,6 +2983,8 @@ class GitRepository(object):
                                % (JOB_NAME, BUILD_NUMBER, BUILD_URL)
         else:
             merge_msg_footer = ""
+        if fingerprint:
+            merge_msg_footer += "\n%s %s" % (FINGERPRINT_TRAILER, fingerprint)
 
         if top_message is None:
             top_message = commit_id
@@ -2069,6 +3226,9 @@ class GitHubCommand(Command):
             '--remote', default="origin",
             help='Name of the remote to use as the origin')
 
+    def add_jobs_arg(self, default=1, help="Number of tasks run concurrently"):
+        add_jobs_argument(self.parser, default=default, help=help)
+
     def add_token_args(self):
         self.parser.add_argument(
             "--token",
@@ -2102,9 +3262,14 @@ class GitRepoCommand(GitHubCommand):
         push_branch = None
         if hasattr(args, "push"):
             push_branch = args.push
+        fetch_options = {}
+        for key in FETCH_OPTIONS:
+            dest = "fetch_%s" % key.replace("-", "_")
+            if hasattr(args, dest):
+                fetch_options[key] = getattr(args, dest)
         self.main_repo = self.gh.git_repo(
             self.cwd, remote=args.remote, push_branch=push_branch,
-            repository_config=repository_config)
+            repository_config=repository_config, fetch_options=fetch_options)
         if not args.shallow:
             self.main_repo.register_submodules()
         if args.reset:
@@ -2127,6 +3292,23 @@ class GitRepoCommand(GitHubCommand):
             ' of the GitHub user')
         self.parser.add_argument('base', type=str)
 
+    def add_fetch_args(self):
+        self.parser.add_argument(
+            '--fetch-filter', metavar='FILTER',
+            help='Partial clone filter used when fetching, e.g. blob:none')
+        self.parser.add_argument(
+            '--fetch-depth', type=int, metavar='DEPTH',
+            help='Limit the fetched history to this number of commits. '
+            'The history is deepened as needed to find merge bases')
+        self.parser.add_argument(
+            '--fetch-shallow-since', metavar='DATE',
+            help='Limit the fetched history to the commits after this date. '
+            'The history is deepened as needed to find merge bases')
+        self.parser.add_argument(
+            '--fetch-negotiation-tip', action='append', metavar='REF',
+            help='Only report the commits reachable from these references '
+            'as already fetched. Can be repeated')
+
     def push(self, args, main_repo):
         branch_name = "HEAD:refs/heads/%s" % (args.push)
 
@@ -2371,29 +3553,88 @@ class CheckLabels(GitRepoCommand):
             action='store_true',
             default=False,
             help='Whether or not to set labels (Admin-only)')
+        self.add_jobs_arg(default=4,
+                          help="Number of labels added concurrently")
+        self.parser.add_argument(
+            '--write-rate', type=float, default=2,
+            help="Maximum number of labels added per second "
+            "(default: %(default)s)")
 
     def __call__(self, args):
         super(CheckLabels, self).__call__(args)
         self.login(args)
         all_repos = self.init_main_repo(args)
+        missing = []
         for repo in all_repos:
             print repo.origin
-            pulls = repo.origin.get_pulls()
-            for pull in pulls:
-                pr = PullRequest(pull)
-                self.check_pr_label(pr,
-                                    args.set and repo.origin.permissions.push)
-
-    def check_pr_label(self, pr, set_label=False):
-        label = pr.base.ref
-        # Read existing labels
-        pr_labels = [x for x in pr.get_labels()]
-        if label not in pr_labels:
-            if set_label:
-                pr.get_issue().add_to_labels(label)
-                print "Added label %s to %s" % (label, pr.number)
-            else:
-                print "Missing label %s on %s" % (label, pr.number)
+            repo_missing = self.find_missing_labels(repo.origin)
+            if args.set and repo.origin.permissions.push:
+                missing.extend(repo_missing)
+                continue
+            # Printed as the PR listing is read
+            for gh_repo, number, label in repo_missing:
+                print "Missing label %s on %s" % (label, number)
+
+        if args.set:
+            created, failed = self.add_labels(
+                missing, jobs=args.jobs, rate=args.write_rate)
+            print "Labels: created %s, added %s, failed %s" \
+                % (created, len(missing) - len(failed), len(failed))
+            if failed:
+                raise Stop(10, "Can't add labels to PR(s) %s" % ", ".join(
+                    "%s#%s" % (gh_repo.repo_name, number)
+                    for gh_repo, number, label in failed))
+
+    def find_missing_labels(self, gh_repo):
+        """
+        Yield the (repository, PR number, label) triplets of the open PRs
+        not labelled with their base branch, read from the PR listing.
+        """
+        for pull in gh_repo.get_pulls():
+            label = pull.base.ref
+            if label not in set(x.name for x in pull.labels):
+                yield gh_repo, pull.number, label
+
+    def add_labels(self, missing, jobs=1, rate=None):
+        """
+        Create the labels missing from each repository once, then add the
+        labels to the issues of the PRs concurrently. The issues are
+        addressed by number without being fetched and the writes are spaced
+        out to respect the write rate.
+
+        Returns: the number of created labels and the list of the triplets
+        which could not be added
+        """
+        throttle = Throttle(rate)
+        labels = {}
+        for gh_repo, number, label in missing:
+            labels.setdefault(gh_repo, set()).add(label)
+        created = 0
+        for gh_repo, names in labels.iteritems():
+            for name in sorted(names - gh_repo.get_label_names()):
+                throttle.wait()
+                gh_repo.create_label(name)
+                created += 1
+
+        @retry_on_error(retries=SCC_RETRIES)
+        def edit(item):
+            gh_repo, number, label = item
+            throttle.wait()
+            gh_repo.get_lazy_issue(number).add_to_labels(label)
+
+        def add(item):
+            try:
+                edit(item)
+            except github.GithubException, ge:
+                return ge
+
+        failed = []
+        for item, error in zip(missing, parallel_map(add, missing, jobs)):
+            if error is not None:
+                self.log.error("Failed to add label %s to PR %s: %s",
+                               item[2], item[1], error)
+                failed.append(item)
+        return created, failed
 
 
 class CheckMilestone(GitRepoCommand):
@@ -2419,6 +3660,12 @@ Usage:
         self.parser.add_argument(
             '--set', dest="milestone_name",
             help="Milestone to use if unset (requires write permissions)")
+        self.add_jobs_arg(default=4,
+                          help="Number of milestones set concurrently")
+        self.parser.add_argument(
+            '--write-rate', type=float, default=2,
+            help="Maximum number of milestones set per second "
+            "(default: %(default)s)")
 
     def __call__(self, args):
         super(CheckMilestone, self).__call__(args)
@@ -2441,6 +3688,32 @@ Usage:
             if not repo.origin.permissions.push:
                 raise Stop(4, "Authenticated user does not have write access")
 
+        pr_numbers, pulls = self.list_release_prs(repo, args)
+        unassigned = []
+        for num in pr_numbers:
+            pr = PullRequest(pulls[num])
+            self.check_pr_milestone(pr)
+            if milestone and (not pr.milestone or
+                              pr.milestone.title != milestone.title):
+                unassigned.append(pr)
+
+        if milestone:
+            failed = self.assign_milestone(
+                repo.origin, unassigned, milestone, jobs=args.jobs,
+                rate=args.write_rate)
+            print "Milestone %s: assigned %s, skipped %s, failed %s PR(s)" \
+                % (milestone.title, len(unassigned) - len(failed),
+                   len(pr_numbers) - len(unassigned), len(failed))
+            if failed:
+                raise Stop(10, "Can't edit milestone of PR(s) %s" % ", ".join(
+                    str(pr.number) for pr in failed))
+
+    def list_release_prs(self, repo, args):
+        """
+        Return the numbers of the PRs merged between the two releases and a
+        dictionary of these PRs fetched in bulk.
+        """
+
         # Construct tag 1 and check its validity
         tag1 = repo.get_tag_prefix() + args.release1
         if not repo.has_local_tag(tag1):
@@ -2458,6 +3731,7 @@ Usage:
             "git", "log", "--oneline", "--first-parent",
             "%s...%s" % (tag1, tag2))
 
+        pr_numbers = []
         for line in o.split("\n"):
             if line.split():
                 try:
@@ -2465,33 +3739,56 @@ Usage:
                 except Exception:
                     self.log.info("Unknown merge: %s", line)
                     continue
-                pr = PullRequest(repo.origin.get_pull(num))
-                self.check_pr_milestone(pr, milestone)
+                pr_numbers.append(num)
 
-    def check_pr_milestone(self, pr, milestone=None):
-        milestone_title = None
-        has_milestone = False
-        if pr.milestone:
-            milestone_title = pr.milestone.title
-            self.log.debug("PR %s in milestone %s",
-                           pr.number, pr.milestone.title)
-            has_milestone = True
-        else:
-            print "No milestone for PR %s: %s" % (pr.number, pr.title)
+        # PRs merged in the range were last updated after the merge base
+        since = repo.get_commit_time(repo.merge_base(tag1, tag2))
+        pulls = repo.origin.get_pulls_by_number(pr_numbers, since=since)
+        return pr_numbers, pulls
+
+    def assign_milestone(self, gh_repo, prs, milestone, jobs=1, rate=None):
+        """
+        Set the milestone of the issues of the PRs concurrently.
+
+        The issues are addressed by number without being fetched and the
+        edits are spaced out to respect the write rate.
+
+        Returns: list of the PRs which could not be edited
+        """
+        throttle = Throttle(rate)
+
+        @retry_on_error(retries=SCC_RETRIES)
+        def edit(pr):
+            throttle.wait()
+            gh_repo.get_lazy_issue(pr.number).edit(milestone=milestone)
 
-        set_milestone = False
-        if milestone and (milestone_title != milestone.title):
+        def assign(pr):
             try:
-                pr.get_issue().edit(milestone=milestone)
+                edit(pr)
+            except github.GithubException, ge:
+                return ge
+
+        failed = []
+        for pr, error in zip(prs, parallel_map(assign, prs, jobs)):
+            if error is None:
                 print "Set milestone for PR %s to %s" \
                     % (pr.number, milestone.title)
-            except github.GithubException, ge:
-                if self.gh.exc_is_not_found(ge):
-                    raise Stop(10, "Can't edit milestone")
-                raise
-            set_milestone = True
+            else:
+                self.log.error("Failed to set milestone for PR %s: %s",
+                               pr.number, error)
+                failed.append(pr)
+        return failed
 
-        return has_milestone, set_milestone
+    def check_pr_milestone(self, pr):
+        """
+        Return whether the PR has a milestone, reporting it otherwise.
+        """
+        if pr.milestone:
+            self.log.debug("PR %s in milestone %s",
+                           pr.number, pr.milestone.title)
+            return True
+        print "No milestone for PR %s: %s" % (pr.number, pr.title)
+        return False
 
 
 class CheckPRs(GitRepoCommand):
@@ -2520,6 +3817,8 @@ command.
         group.add_argument(
             '--cache-dir',
             help="Directory to use to cache the rebased links.")
+        self.add_jobs_arg(default=8,
+                          help="Number of PRs fetched concurrently")
 
         self.parser.add_argument('a', help="First branch to compare")
         self.parser.add_argument('b', help="Second branch to compare")
@@ -2530,6 +3829,7 @@ command.
     def __call__(self, args):
         super(CheckPRs, self).__call__(args)
         self.login(args)
+        self.jobs = args.jobs
 
         if args.parse:
             self.parse(args.a, args.b)
@@ -2547,6 +3847,7 @@ command.
                 self.prs = {}
                 self.links = {}
                 self.rebasedprs = set()
+                self.store = None
                 s_unrebased, s_mismatch = self.notes(repo, args)
                 unrebased_count += s_unrebased
                 mismatch_count += s_mismatch
@@ -2564,12 +3865,21 @@ command.
         self.load_links(cache_dir=args.cache_dir,
                         cache_name=repo.origin.repo_name + '.rebased')
         self.rebasedprs.update(self.links.keys())
+        try:
+            return self.check_notes(repo, args)
+        finally:
+            if self.store is not None:
+                self.store.close()
+
+    def check_notes(self, repo, args):
 
         # List unrebased PRs
+        pr_list_a, pr_list_b = self.list_prs(
+            repo, args.a, args.b, remote=args.remote)
         count1 = self.list_unrebased_prs(
-            repo, args.a, args.b, remote=args.remote, write=args.write)
+            repo, args.a, args.b, pr_list_a, write=args.write)
         count2 = self.list_unrebased_prs(
-            repo, args.b, args.a, remote=args.remote, write=args.write)
+            repo, args.b, args.a, pr_list_b, write=args.write)
         unrebased_count = count1 + count2
 
         if not args.no_check:
@@ -2593,65 +3903,65 @@ command.
             mismatch_count = 0
 
         # Cache the rebased links
-        rebased_links = dict((k, self.links[k]) for k in self.links
-                             if k in self.rebasedprs)
-        self.dump_links(rebased_links, cache_dir=args.cache_dir,
-                        cache_name=repo.origin.repo_name + '.rebased')
+        self.dump_links()
 
         return unrebased_count, mismatch_count
 
-    def list_prs(self, repo, source_branch, target_branch, remote="origin"):
+    def list_prs(self, repo, branch_a, branch_b, remote="origin"):
+        """
+        Return the lists of PRs merged on the first-parent history of each
+        branch since their branching point and without a see_also note for
+        the other branch.
+
+        The notes of both branches are indexed first and joined against
+        the first-parent history streamed from git log.
+        """
 
-        git_notes_ref = "refs/notes/see_also/" + target_branch
         merge_base = repo.find_branching_point(
-            "%s/%s" % (remote, source_branch),
-            "%s/%s" % (remote, target_branch))
-        merge_range = "%s...%s/%s" % (merge_base, remote, source_branch)
-        middle_marker = str(uuid.uuid4()).replace("-", "")
-        end_marker = str(uuid.uuid4()).replace("-", "")
-
-        cmd = [
-            "git", "log",
-            "--pretty=%%h %%s %%ar %s %%N %s" % (middle_marker, end_marker),
-            "--first-parent", merge_range]
-        if git_version() > (2, 7, 6):
-                cmd += ["--notes=%s" % git_notes_ref]
-        out = repo.communicate(*cmd)
-
-        # List PRs without seealso notes
-        pr_list = []
-        for line in out.split(end_marker):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                line, rest = line.split(middle_marker)
-            except Exception:
-                raise Exception("can't split on ##: " + line)
-            if "See gh-" in rest or "n/a" in rest:
-                continue
+            "%s/%s" % (remote, branch_a), "%s/%s" % (remote, branch_b))
+        notes = repo.get_notes(
+            ["refs/notes/see_also/" + x for x in (branch_b, branch_a)])
+
+        pr_lists = []
+        for source_branch, source_notes in zip((branch_a, branch_b), notes):
+            # List PRs without seealso notes
+            pr_list = []
+            merge_range = "%s..%s/%s" % (merge_base, remote, source_branch)
+            for line in repo.iter_log("%H %h %s %ar", "--first-parent",
+                                      merge_range):
+                sha1, line = line.split(" ", 1)
+                note = source_notes.get(sha1, "")
+                if "See gh-" in note or "n/a" in note:
+                    continue
 
-            try:
-                sha1, num, rest = self.parse_pr(line)
-                pr_list.append(num)
-            except Exception:
-                self.log.info("Unknown merge: %s", line)
-        return pr_list
+                try:
+                    sha1, num, rest = self.parse_pr(line)
+                    pr_list.append(num)
+                except Exception:
+                    self.log.info("Unknown merge: %s", line)
+            pr_lists.append(pr_list)
+        return pr_lists
 
-    def list_unrebased_prs(self, repo, source_branch, target_branch,
-                           remote="origin", write=False):
+    def list_unrebased_prs(self, repo, source_branch, target_branch, pr_list,
+                           write=False):
         """
         Method for listing unrebased PRs while filtering out those which
         """
 
-        pr_list = self.list_prs(repo, source_branch, target_branch, remote)
         self.log.debug(
             "Found %s first-parent PRs merged on %s without a see_also note"
             " for %s" % (len(pr_list), source_branch, target_branch))
 
         # Look into PR body/comment for rebase notes and fill match dictionary
+        pr_list = [x for x in pr_list if x not in self.rebasedprs]
+        self.prefetch_prs(repo.origin, pr_list)
+        targets = []
+        for pr_number in pr_list:
+            targets.extend(self.read_links(self.links, pr_number)[0] or [])
+        self.prefetch_prs(repo.origin, targets)
+
         unrebased_prs = []
-        for pr_number in [x for x in pr_list if x not in self.rebasedprs]:
+        for pr_number in pr_list:
             pr = self.visit_pr(repo.origin, pr_number)
 
             # No rebase comment found on the PR
@@ -2695,93 +4005,104 @@ command.
         for target in targets:
             target_pr = self.visit_pr(repo.origin, target)
             target_status = (target_pr.pull.state == 'open' or
-                             target_pr.pull.merged)
+                             target_pr.has_merge_time())
 
             # Check  PR is open or merged against the target branch
             if (target_status and target_pr.get_base() == target_branch):
                 self.log.debug("PR %s is rebased as %s on %s"
                                % (pr_number, target, target_branch))
                 # List as rebased is both the source and target PRs are merged
-                if target_pr.pull.merged and self.prs[pr_number].pull.merged:
+                if target_pr.has_merge_time() and \
+                        self.prs[pr_number].has_merge_time():
                     self.rebasedprs.add(pr_number)
                 return True
         return False
 
     def load_links(self, cache_dir=None, cache_name="cache"):
-        """Load links from local cache"""
+        """
+        Open the links store of the cache directory and load the rebased
+        links. The links of a legacy pickle cache are imported first and
+        the pickle is then renamed so that it is only imported once.
+        """
 
+        self.store = None
         if cache_dir is None:
             self.log.debug("No cache_dir specified. Skipping.")
             return
 
-        cache_full_path = os.path.join(cache_dir, cache_name + '.cache')
-        if not os.path.isfile(cache_full_path):
-            self.log.debug("%s does not exist. Skipping.", cache_full_path)
+        if not os.path.isdir(cache_dir):
+            self.log.debug("%s does not exist. Skipping.", cache_dir)
             return
 
-        import pickle
-        with open(cache_full_path, 'rb') as handle:
-            self.log.debug('Read links from %s', cache_full_path)
-            self.links.update(pickle.loads(handle.read()))
+        store_path = os.path.join(cache_dir, cache_name + '.sqlite')
+        self.log.debug('Read links from %s', store_path)
+        self.store = LinksStore(store_path)
 
-    def dump_links(self, links, cache_dir=None, cache_name="cache"):
-        """Cache links locally"""
+        cache_full_path = os.path.join(cache_dir, cache_name + '.cache')
+        if os.path.isfile(cache_full_path):
+            import pickle
+            with open(cache_full_path, 'rb') as handle:
+                self.log.debug('Import links from %s', cache_full_path)
+                self.store.import_links(pickle.loads(handle.read()))
+            os.rename(cache_full_path, cache_full_path + '.migrated')
 
-        if cache_dir is None:
-            self.log.debug("No cache_dir specified. Skipping.")
-            return
+        self.links.update(self.store.get_rebased())
 
-        if not os.path.isdir(cache_dir):
-            self.log.debug("%s does not exist. Skipping.", cache_dir)
+    def dump_links(self):
+        """Record the rebased state of the visited links in the store"""
+
+        if self.store is None:
+            self.log.debug("No cache_dir specified. Skipping.")
             return
 
-        import pickle
-        cache_full_path = os.path.join(cache_dir, cache_name + '.cache')
-        with open(cache_full_path, 'wb') as handle:
-            self.log.debug('Dump links to %s', cache_full_path)
-            pickle.dump(links, handle)
+        self.log.debug('Dump links to %s', self.store.path)
+        self.store.set_rebased(
+            [x for x in self.links if x in self.rebasedprs])
+        self.store.set_rebased(
+            [x for x in self.links if x not in self.rebasedprs],
+            rebased=False)
 
     def check_links(self, gh_repo):
         """Return a dictionary of PRs with missing rebase comments"""
 
-        m = self.check_directed_links(self.links)
-
         # Ensure all nodes (PRs) are visited - handling chained links
-        while not all(x in self.links.keys() for x in m.keys()):
-
-            for pr_number in [key for key in m.keys()
-                              if key not in self.links.keys()]:
-                self.visit_pr(gh_repo, pr_number)
+        visits = self.links.keys()
+        while visits:
+            targets = set()
+            for pr_number in visits:
+                targets.update(self.read_links(self.links, pr_number)[0] or [])
+            visits = [x for x in targets if x not in self.links]
+            if visits:
+                self.prefetch_prs(gh_repo, visits)
 
-            m = self.check_directed_links(self.links)
-
-        return m
+        return self.check_directed_links(self.links)
 
     @staticmethod
     def check_directed_links(links):
         """Find mismatching comments in rebased PRs"""
 
+        # Index the rebase links of each PR, ignoring trailing comments
+        index = {}
+        for pr_number, pr_links in links.iteritems():
+            if pr_links and pr_links != -1:
+                index[pr_number] = set(
+                    m.group(0) for m in (
+                        re.match(r"-(to|from) #\d+", x) for x in pr_links)
+                    if m)
+
         mismatch_dict = {}
-        for source_pr in links.keys():
+        for source_pr in links:
             # Do not check PRs without rebase comments or marked as no-rebase
-            if links[source_pr] == -1 or links[source_pr] is None:
+            if source_pr not in index:
                 continue
 
             targets, target_links = CheckPRs.read_links(links, source_pr)
             for target_pr, target_link in zip(targets, target_links):
 
-                if target_pr not in links.keys():
-                    # Target PR has not been visited
-                    mismatch = True
-                elif links[target_pr] is None or links[target_pr] == -1:
-                    # Target PR has no rebase comment or marked as non-rebase
-                    mismatch = True
-                elif not any(x.startswith(target_link) for x
-                             in links[target_pr]):
-                    # Non-matching target PR rebase comments
-                    mismatch = True
-                else:
-                    mismatch = False
+                # Mismatch if the target PR has not been visited, has no
+                # rebase comment, is marked as non-rebase or has no
+                # matching rebase comment
+                mismatch = target_link not in index.get(target_pr, ())
 
                 if mismatch:
                     if target_pr in mismatch_dict:
@@ -2792,20 +4113,55 @@ command.
         return mismatch_dict
 
     def visit_pr(self, gh_repo, pr_number):
-        if pr_number not in self.prs.keys():
-            pr = PullRequest(gh_repo.get_pull(pr_number))
-            self.prs[pr_number] = pr
-
-        if pr_number not in self.links.keys():
-            self.links[pr_number] = None
-            if pr.parse('no-rebase'):
-                self.links[pr_number] = -1
+        self.prefetch_prs(gh_repo, [pr_number])
+        return self.prs[pr_number]
+
+    def prefetch_prs(self, gh_repo, pr_numbers):
+        """
+        Fetch the PRs and parse their rebase links using a pool of threads.
+
+        Several PRs are read from the pages of the PR listing where
+        possible, see get_pulls_by_number. The PRs and their links are
+        recorded in the main thread, the links of the PRs whose update
+        time is unchanged since their last visit being read from the
+        store without fetching their comments.
+        """
+        pr_numbers = sorted(set(pr_numbers))
+        fetched = [x for x in pr_numbers if x not in self.prs]
+        if len(fetched) > 1:
+            pulls = gh_repo.get_pulls_by_number(fetched, jobs=self.jobs)
+        else:
+            pulls = dict((x, gh_repo.get_pull(x)) for x in fetched)
+        for pr_number in fetched:
+            self.prs[pr_number] = PullRequest(pulls[pr_number])
+
+        parsed = []
+        for pr_number in [x for x in pr_numbers if x not in self.links]:
+            row = None
+            if self.store is not None:
+                row = self.store.get(pr_number)
+            updated_at = str(self.prs[pr_number].pull.updated_at)
+            if row is not None and row[3] == updated_at:
+                # Unchanged since the last visit
+                self.links[pr_number] = row[0]
             else:
-                rebased_links = pr.parse(['rebased'])
-                if rebased_links:
-                    self.links[pr_number] = rebased_links
+                parsed.append(pr_number)
 
-        return self.prs[pr_number]
+        links = parallel_map(lambda x: self.parse_links(self.prs[x]),
+                             parsed, self.jobs)
+        for pr_number, pr_links in zip(parsed, links):
+            self.links[pr_number] = pr_links
+            if self.store is not None:
+                pr = self.prs[pr_number]
+                self.store.put(pr_number, pr_links, pr.has_merge_time(),
+                               str(pr.pull.updated_at))
+
+    @staticmethod
+    def parse_links(pr):
+        """Return the rebase links of a PR, -1 if marked as no-rebase"""
+        if pr.parse('no-rebase'):
+            return -1
+        return pr.parse(['rebased']) or None
 
     @staticmethod
     def read_links(links, pr_number):
@@ -2897,19 +4253,11 @@ class AlreadyMerged(GitHubCommand):
         fmt = "%(committerdate:iso8601) %(refname:short)   --- %(subject)"
         cmd = ["git", "for-each-ref", "--sort=committerdate"]
         cmd.append("--format=%s" % fmt)
+        cmd.append("--merged=%s" % args.target)
         cmd += args.ref
-        out = main_repo.communicate(*cmd)
-        for line in out.split("\n"):
+        for line in main_repo.iter_output(*cmd):
             if line:
-                self.go(main_repo, line.rstrip(), args.target)
-
-    def go(self, main_repo, input, target):
-        parts = input.split(" ")
-        branch = parts[3]
-        tip = main_repo.communicate("git", "rev-parse", branch)
-        mrg = main_repo.merge_base(branch, target)
-        if tip == mrg:
-            print input
+                print line.rstrip()
 
 
 class CleanSandbox(GitHubCommand):
@@ -2964,28 +4312,71 @@ class ExternalIssues(GitHubCommand):
         self.parser.add_argument(
             'orgs', nargs="+",
             help="organizations that should be checked")
+        self.add_jobs_arg(default=4,
+                          help="Number of organization memberships listed "
+                          "concurrently")
 
     def __call__(self, args):
         super(ExternalIssues, self).__call__(args)
         self.login(args)
-        for org in args.orgs:
-            query = "is:open"
-            query += " is:issue"
-            query += " user:%s" % org
-            query += " archived:false"
-            org = self.gh.get_organization(org)
-            for m in org.get_members():
-                query += " -author:%s" % m.login
-            issues = []
-            for issue in self.gh.search_issues(query):
-                issues.append(' - [???] [\\[%s\\] %s ](%s) (%s)' % (
-                    issue.repository.name,
-                    issue.title,
-                    issue.html_url,
-                    issue.user.login,
-                ))
-            print "##", org.login, "(%s)" % len(issues), "##"
-            print "\n".join(sorted(issues))
+        # The memberships are listed concurrently but the searches run one
+        # organization at a time within the search rate limit
+        orgs = parallel_map(self.gh.get_organization, args.orgs, args.jobs)
+        members = parallel_map(self.gh.get_members, orgs, args.jobs)
+        for org, org_members in zip(orgs, members):
+            print "##", org.login, "##"
+            count = 0
+            for line in self.find_external_issues(org, org_members):
+                print line
+                sys.stdout.flush()
+                count += 1
+            print "(%s)" % count
+
+    def find_external_issues(self, org, members):
+        """
+        Yield the open issues of the repositories of an organization opened
+        by non-members as the search results are streamed, filtering their
+        authors against the membership set.
+
+        GitHub only returns the first 1000 results of a search so larger
+        organizations are listed one repository at a time instead.
+        """
+        query = "is:open"
+        query += " is:issue"
+        query += " user:%s" % org.login
+        query += " archived:false"
+        results = self.gh.search_issues(query)
+        count = self.gh.get_search_count(results)
+        if count > MAX_SEARCH_RESULTS:
+            self.log.warn(
+                "%s open issues found in %s, listing each repository",
+                count, org.login)
+            results = self.find_repository_issues(org)
+        else:
+            results = ((issue.repository.name, issue)
+                       for issue in self.gh.iter_search(results))
+
+        for name, issue in results:
+            if issue.user.login in members:
+                continue
+            yield ' - [???] [\\[%s\\] %s ](%s) (%s)' % (
+                name,
+                issue.title,
+                issue.html_url,
+                issue.user.login,
+            )
+
+    def find_repository_issues(self, org):
+        """
+        Yield the repository name and the open issues of each non-archived
+        repository of the organization, skipping pull requests.
+        """
+        for repo in org.get_repos():
+            if repo.raw_data.get("archived"):
+                continue
+            for issue in repo.get_issues(state="open"):
+                if issue.pull_request is None:
+                    yield repo.name, issue
 
 
 class UnsubscribedRepos(GitHubCommand):
@@ -3005,17 +4396,12 @@ class UnsubscribedRepos(GitHubCommand):
     def __call__(self, args):
         super(UnsubscribedRepos, self).__call__(args)
         self.login(args)
-        login = self.gh.get_login()
+        subscriptions = self.gh.get_subscriptions()
         for org in args.orgs:
             print org
             org = self.gh.get_organization(org)
             for repo in org.get_repos():
-                found = False
-                for user in repo.get_subscribers():
-                    if user.login == login:
-                        found = True
-                        break
-                if not found:
+                if repo.full_name not in subscriptions:
                     print "\t", repo.name
 
 
@@ -3162,6 +4548,28 @@ class Merge(FilteredPullRequestsCommand):
         self.parser.add_argument(
             '--repository-config',
             help='Repository configuration file (YAML)')
+        self.parser.add_argument(
+            '--incremental', metavar='REF',
+            help='Reuse the leading merge commits of a previous merge, e.g. '
+            'a previously pushed merge branch, for the PRs whose head is '
+            'unchanged and only merge the remaining PRs')
+        self.parser.add_argument(
+            '--skip-unchanged', action='store_true',
+            help='Exit without merging if the base branches, the candidate '
+            'PRs and the filters are unchanged since the last push of the '
+            'merged branch. Requires --push')
+        self.parser.add_argument(
+            '--batch', action='store_true',
+            help='Merge PRs using octopus merges of groups of PRs, '
+            'bisecting the groups which fail to merge')
+        self.parser.add_argument(
+            '--report', metavar='FILE',
+            help='Stream the merge events to this file as newline-delimited '
+            'JSON records. Use - for the standard error')
+        self.add_jobs_arg(
+            help="Number of worktrees used to trial-merge each PR against "
+            "the base in parallel before merging them")
+        self.add_fetch_args()
         self.add_new_commit_args()
 
     def get_action(self):
@@ -3199,17 +4607,53 @@ class Merge(FilteredPullRequestsCommand):
         if args.check_commit_status:
             commit_args.append("-S%s" % args.check_commit_status)
 
-        updated, merge_msg = main_repo.rmerge(
-            self.filters, args.info,
-            args.comment, commit_id=" ".join(commit_args),
-            top_message=args.message,
-            update_gitmodules=args.update_gitmodules,
-            set_commit_status=args.set_commit_status)
+        fingerprint = None
+        if args.skip_unchanged and args.push and not args.info:
+            fingerprint = self.check_fingerprint(args, main_repo, commit_args)
+
+        if args.report == "-":
+            report_file = sys.stderr
+        elif args.report:
+            report_file = open(args.report, "w")
+        else:
+            report_file = None
+
+        try:
+            updated, merge_msg = main_repo.rmerge(
+                self.filters, args.info,
+                args.comment, commit_id=" ".join(commit_args),
+                top_message=args.message,
+                update_gitmodules=args.update_gitmodules,
+                set_commit_status=args.set_commit_status,
+                incremental=args.incremental, fingerprint=fingerprint,
+                batch=args.batch, report=MergeReport(report_file),
+                jobs=args.jobs)
+        finally:
+            if report_file not in (None, sys.stderr):
+                report_file.close()
 
         for line in merge_msg.split("\n"):
             self.log.info(line)
         return updated
 
+    def check_fingerprint(self, args, main_repo, commit_args):
+        """
+        Compare the fingerprint of the merge inputs with the one recorded
+        by the last push of the merged branch and stop if they match.
+        """
+
+        options = [commit_args, args.message, args.update_gitmodules,
+                   args.comment, args.set_commit_status, args.batch]
+        fingerprint = main_repo.rfingerprint(self.filters, options=options)
+        self.log.debug("Merge fingerprint: %s", fingerprint)
+
+        url = "git@github.com:%s/%s.git" % (
+            self.gh.get_login(), main_repo.origin.repo_name)
+        if main_repo.get_fingerprint(url, args.push) == fingerprint:
+            raise Stop(0, "Merge inputs unchanged since the last push of %s."
+                       " Skipping." % args.push)
+        return fingerprint
+
 
 class MilestoneCommand(GitRepoCommand):
     """
@@ -3370,6 +4814,11 @@ class Rebase(GitRepoCommand):
         6) If delete is not set, omit the deleting of the newbranch.
 
         If --remote is not set, 'origin' will be used.
+
+        Several PRs can be rebased at once after a single fetch. PRs which
+        cannot be rebased are skipped, the other branches are pushed
+        together and their PRs opened concurrently. The PRs are listed
+        explicitly and the command exits with 24 if any of them failed.
     """
 
     NAME = "rebase"
@@ -3391,15 +4840,24 @@ class Rebase(GitRepoCommand):
         self.parser.add_argument(
             '--continue', action="store_true", dest="_continue",
             help="Continue from a failed rebase")
+        self.add_jobs_arg(default=4, help="Number of PRs opened concurrently")
+        self.parser.add_argument(
+            '--write-rate', type=float, default=1,
+            help="Maximum number of rebased PRs opened per second "
+            "(default: %(default)s)")
+        self.add_fetch_args()
 
         self.parser.add_argument(
-            'PR', type=int, help="The number of the pull request to rebase")
+            'PR', type=int, nargs="+",
+            help="The numbers of the pull requests to rebase")
         self.parser.add_argument(
             'newbase', type=str,
             help="The branch of origin onto which the PR should be rebased")
 
     def __call__(self, args):
         super(Rebase, self).__call__(args)
+        if args._continue and len(args.PR) > 1:
+            raise Stop(23, "--continue requires a single pull request")
         self.login(args)
 
         args.shallow = True
@@ -3422,8 +4880,15 @@ class Rebase(GitRepoCommand):
         except Exception:
             old_branch = self.main_repo.get_current_sha1()
 
-        pr, new_branch = self.local_rebase(args.PR, args.newbase, args.remote,
-                                           args._continue)
+        if len(args.PR) == 1:
+            self.rebase_pr(args, old_branch)
+        else:
+            self.rebase_prs(args, old_branch)
+
+    def rebase_pr(self, args, old_branch):
+
+        pr, new_branch = self.local_rebase(args.PR[0], args.newbase,
+                                           args.remote, args._continue)
         if args.push or args.pr:
             try:
                 self.push_branch(new_branch)
@@ -3435,6 +4900,78 @@ class Rebase(GitRepoCommand):
             if args.delete:
                 self.main_repo.delete_local_branch(new_branch, force=True)
 
+    def rebase_prs(self, args, old_branch):
+
+        try:
+            rebased, failed = self.local_rebases(
+                args.PR, args.newbase, old_branch, args.remote)
+        finally:
+            self.main_repo.checkout_branch(old_branch)
+
+        new_branches = [new_branch for pr, new_branch in rebased]
+        if new_branches and (args.push or args.pr):
+            try:
+                self.push_branches(new_branches)
+                if args.pr:
+                    failed += self.open_prs(rebased, args.newbase, args.jobs,
+                                            args.write_rate)
+            finally:
+                self.main_repo.checkout_branch(old_branch)
+
+            if args.delete:
+                for new_branch in new_branches:
+                    self.main_repo.delete_local_branch(new_branch, force=True)
+
+        if failed:
+            raise Stop(24, "Failed to rebase PR(s) %s" % ", ".join(
+                str(x) for x in failed))
+
+    def local_rebases(self, pr_numbers, newbase, old_branch,
+                      remote="origin"):
+        """
+        Rebase several PRs independently. The PRs which cannot be rebased
+        or whose rebased branch already exists on the user remote are
+        skipped after restoring the original branch.
+
+        Returns: the list of (PR, new branch) which were rebased and the
+        list of the numbers of the PRs which were not
+        """
+        user = self.gh.get_login()
+        rebased = []
+        failed = []
+        for pr_number in pr_numbers:
+            try:
+                pr, new_branch = self.local_rebase(pr_number, newbase, remote)
+            except Exception, e:
+                if isinstance(e, Stop) and e.rc == 20:
+                    message = "Conflicts rebasing onto %s" % newbase
+                else:
+                    message = str(e)
+                self.log.error("PR %s: %s", pr_number, message)
+                self.restore_branch(old_branch)
+                failed.append(pr_number)
+                continue
+
+            if self.main_repo.has_remote_branch(new_branch, remote=user):
+                self.log.error("PR %s: Branch %s already exists in %s remote",
+                               pr_number, new_branch, user)
+                self.main_repo.checkout_branch(old_branch)
+                self.main_repo.delete_local_branch(new_branch, force=True)
+                failed.append(pr_number)
+            else:
+                rebased.append((pr, new_branch))
+        return rebased, failed
+
+    def restore_branch(self, old_branch):
+        """
+        Abort any rebase left in progress and check out the original branch.
+        """
+        try:
+            self.main_repo.abort_rebase()
+        except Exception:
+            self.log.debug("No rebase to abort")
+        self.main_repo.checkout_branch(old_branch)
+
     def local_rebase(self, pr_number, newbase, remote="origin", skip=False):
 
         # Remote information
@@ -3463,6 +5000,9 @@ class Rebase(GitRepoCommand):
 
         remote_newbase = "%s/%s" % (remote, newbase)
         if not skip:
+            self.main_repo.deepen(
+                [pr_head], upstream="%s/%s" % (remote, pr.base.ref),
+                remotes=[remote])
             branching_sha1 = self.main_repo.find_branching_point(
                 pr_head, "%s/%s" % (remote, pr.base.ref))
 
@@ -3482,28 +5022,61 @@ class Rebase(GitRepoCommand):
         return pr, new_branch
 
     def push_branch(self, new_branch):
+        self.push_branches([new_branch])
+
+    def push_branches(self, new_branches):
 
         user = self.gh.get_login()
         # Fail-fast if remote branch exist with the target name
-        if self.main_repo.has_remote_branch(new_branch, remote=user):
-            raise Stop(19, 'Branch %s already exists in %s remote'
-                       % (new_branch, user))
+        for new_branch in new_branches:
+            if self.main_repo.has_remote_branch(new_branch, remote=user):
+                raise Stop(19, 'Branch %s already exists in %s remote'
+                           % (new_branch, user))
 
         remote = "git@github.com:%s/%s.git" % (
             user, self.main_repo.origin.name)
         push_msg = ""
         if user in self.main_repo.list_remotes():
             try:
-                self.main_repo.push_branch(new_branch, remote=user)
-                push_msg = "# Pushed %s to %s" % (new_branch, user)
+                self.main_repo.push_branches(new_branches, remote=user)
+                push_msg = "# Pushed %s to %s" % (
+                    ", ".join(new_branches), user)
             except Exception:
                 self.log.info('Could not push to remote %s' % user)
 
         if not push_msg:
-            self.main_repo.push_branch(new_branch, remote=remote)
-            push_msg = "# Pushed %s to %s" % (new_branch, remote)
+            self.main_repo.push_branches(new_branches, remote=remote)
+            push_msg = "# Pushed %s to %s" % (", ".join(new_branches), remote)
         print >> sys.stderr, push_msg
 
+    def open_prs(self, rebased, newbase, jobs=1, rate=None):
+        """
+        Open the rebased PRs and add the rebase comments concurrently,
+        spacing out the PRs to respect the write rate.
+
+        Returns: the list of the numbers of the PRs which could not be
+        opened
+        """
+        throttle = Throttle(rate)
+
+        def open_pr(item):
+            pr, new_branch = item
+            throttle.wait()
+            try:
+                return self.open_pr(new_branch, newbase, pr)
+            except github.GithubException, ge:
+                self.log.error("PR %s: cannot open the rebased PR: %s",
+                               pr.number, ge)
+
+        failed = []
+        for (pr, new_branch), url in zip(
+                rebased, parallel_map(open_pr, rebased, jobs)):
+            if url is None:
+                failed.append(pr.number)
+            else:
+                print url
+        return failed
+
     def open_pr(self, new_branch, newbase, pr):
 
         user = self.gh.get_login()
@@ -3522,11 +5095,11 @@ This is the same as gh-%(id)s but rebased onto %(base)s.
 
         rebased_pr = PullRequest(self.main_repo.origin.open_pr(
             title, body, base=newbase, head="%s:%s" % (user, new_branch)))
-        print rebased_pr.html_url
 
         # Add rebase comments
         pr.create_issue_comment('--rebased-to #%s' % rebased_pr.number)
         rebased_pr.create_issue_comment('--rebased-from #%s' % pr.number)
+        return rebased_pr.html_url
 
     def get_conflict_message(self, pr, newbase):
         msg = 'Rebasing failed\nYou are now in detached HEAD mode\n\n'
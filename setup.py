@@ -112,7 +112,7 @@ setup(name='scc',
       packages=['scc'],
       include_package_data=True,
       install_requires=['yaclifw>=0.1.2',
-                        'PyGithub',
+                        'PyGithub==1.43.8',
                         'argparse',
                         'PyYAML==3.11',
                         'six'],
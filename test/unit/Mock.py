@@ -21,11 +21,16 @@
 
 from github.AuthenticatedUser import AuthenticatedUser
 from github.Repository import Repository
+from github import GithubException
 
 from scc.git import GHManager
 from scc.git import GitHubRepository
 
 from mox import Mox
+import pytest
+
+# Run the concurrent commands both serially and with a thread pool
+parametrize_jobs = pytest.mark.parametrize('jobs', [1, 4])
 
 
 class MoxTestBase(object):
@@ -55,3 +60,74 @@ class MockTest(MoxTestBase):
         self.mox.ReplayAll()
 
         self.gh_repo = GitHubRepository(self.gh, "mock", "mock")
+
+
+class MockLabel(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class MockRef(object):
+
+    def __init__(self, ref):
+        self.ref = ref
+
+
+class MockPR(object):
+
+    def __init__(self, number, base="master", labels=()):
+        self.number = number
+        self.base = MockRef(base)
+        self.labels = [MockLabel(x) for x in labels]
+
+
+class MockIssue(object):
+    """
+    Issue addressed by number whose edits are recorded by its repository.
+    Editing an issue with a negative number fails as for a missing issue.
+    """
+
+    def __init__(self, number, repo):
+        self.number = number
+        self.repo = repo
+
+    def check_exists(self):
+        if self.number < 0:
+            raise GithubException(404, "Not Found")
+
+    def edit(self, milestone):
+        self.check_exists()
+        self.repo.edits.append((self.number, milestone))
+
+    def add_to_labels(self, label):
+        self.check_exists()
+        self.repo.added.append((self.number, label))
+
+
+class MockGitHubRepository(object):
+    """
+    In-memory stand-in for the GitHubRepository methods used when editing
+    issues concurrently.
+    """
+
+    def __init__(self, name="mock", labels=(), pulls=()):
+        self.repo_name = name
+        self.labels = set(labels)
+        self.pulls = list(pulls)
+        self.edits = []
+        self.added = []
+        self.created = []
+
+    def get_pulls(self):
+        return iter(self.pulls)
+
+    def get_label_names(self):
+        return set(self.labels)
+
+    def create_label(self, name):
+        self.created.append(name)
+        self.labels.add(name)
+
+    def get_lazy_issue(self, number):
+        return MockIssue(number, self)
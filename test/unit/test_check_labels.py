@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2014 University of Dundee & Open Microscopy Environment
+# All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from yaclifw.framework import parsers
+
+from scc.git import CheckLabels
+from Mock import MockGitHubRepository, MockPR, parametrize_jobs
+
+
+class TestCheckLabels(object):
+
+    def setup_method(self, method):
+        self.scc_parser, self.sub_parser = parsers()
+        self.command = CheckLabels(self.sub_parser)
+
+    def test_find_missing_labels(self):
+        repo = MockGitHubRepository("repo", [], [
+            MockPR(1, "master", ["master"]),
+            MockPR(2, "develop", []),
+            MockPR(3, "master", ["develop", "bug"])])
+        assert list(self.command.find_missing_labels(repo)) == [
+            (repo, 2, "develop"), (repo, 3, "master")]
+
+    @parametrize_jobs
+    def test_add_labels(self, jobs):
+        repo1 = MockGitHubRepository("repo1", ["master"])
+        repo2 = MockGitHubRepository("repo2", ["develop"])
+        missing = [(repo1, 1, "master"), (repo1, 2, "develop"),
+                   (repo1, 3, "develop"), (repo2, 1, "develop"),
+                   (repo2, -2, "master")]
+        created, failed = self.command.add_labels(missing, jobs=jobs)
+        assert created == 2
+        assert repo1.created == ["develop"]
+        assert repo2.created == ["master"]
+        assert failed == [(repo2, -2, "master")]
+        assert sorted(repo1.added) == [
+            (1, "master"), (2, "develop"), (3, "develop")]
+        assert repo2.added == [(1, "develop")]
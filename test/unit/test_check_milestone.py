@@ -22,15 +22,16 @@
 from yaclifw.framework import parsers
 
 from github.AuthenticatedUser import AuthenticatedUser
-from github.Issue import Issue
 from github.Milestone import Milestone
 from github.PullRequest import PullRequest
 from github.PullRequestPart import PullRequestPart
 from github.Repository import Repository
 
-from scc.git import CheckMilestone, PullRequest as PR
+from scc.git import CheckMilestone, PullRequest as PR, Throttle
 import pytest
-from Mock import MoxTestBase
+import time
+from Mock import MoxTestBase, MockGitHubRepository, MockPR
+from Mock import parametrize_jobs
 
 
 class TestCheckMilestone(MoxTestBase):
@@ -53,7 +54,6 @@ class TestCheckMilestone(MoxTestBase):
         self.pull.title = 'test'
         self.pull.milestone = None
         self.pull.base = self.base
-        self.issue = self.mox.CreateMock(Issue)
         self.milestones = []
         self.milestones.append(self.mox.CreateMock(Milestone))
         self.milestones[0].title = 'test 1'
@@ -67,21 +67,31 @@ class TestCheckMilestone(MoxTestBase):
         self.pull.milestone = self.milestones[milestone_index]
 
     @pytest.mark.parametrize('milestone_index', [None, 0, 1])
-    def test_no_milestone(self, milestone_index):
+    def test_check_pr_milestone(self, milestone_index):
         self.assign_milestone(milestone_index)
-        [mcheck, mset] = self.command.check_pr_milestone(self.pr, None)
-        assert mcheck is (milestone_index is not None)
-        assert not mset
+        assert self.command.check_pr_milestone(self.pr) is \
+            (milestone_index is not None)
 
-    @pytest.mark.parametrize('milestone_index', [None, 0, 1])
-    def test_check_existing_milestone(self, milestone_index):
-        self.assign_milestone(milestone_index)
-        if milestone_index != 0:
-            self.base_repo.get_issue(self.pr.number).AndReturn(self.issue)
-            self.issue.edit(milestone=self.milestones[0]).AndReturn(True)
-            self.mox.ReplayAll()
 
-        [mcheck, mset] = self.command.check_pr_milestone(
-            self.pr, self.milestones[0])
-        assert mcheck is (milestone_index is not None)
-        assert mset == (milestone_index != 0)
+class TestAssignMilestone(object):
+
+    def setup_method(self, method):
+        self.scc_parser, self.sub_parser = parsers()
+        self.command = CheckMilestone(self.sub_parser)
+        self.repo = MockGitHubRepository()
+
+    @parametrize_jobs
+    def test_assign(self, jobs):
+        prs = [MockPR(x) for x in [1, -2, 3, 4]]
+        failed = self.command.assign_milestone(
+            self.repo, prs, "milestone", jobs=jobs)
+        assert failed == [prs[1]]
+        assert sorted(self.repo.edits) == [
+            (1, "milestone"), (3, "milestone"), (4, "milestone")]
+
+    def test_throttle(self):
+        throttle = Throttle(20)
+        start = time.time()
+        for i in range(5):
+            throttle.wait()
+        assert time.time() - start >= 0.2
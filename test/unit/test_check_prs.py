@@ -19,7 +19,11 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from scc.git import CheckPRs
+from yaclifw.framework import parsers
+
+from scc.git import CheckPRs, LinksStore
+import logging
+import pickle
 import pytest
 
 no_link_types = [None, -1]
@@ -88,3 +92,169 @@ class TestCheckDirectedLinks(object):
             1: ['-%s #2' % source_prefix],
             2: ['-%s #1%s' % (target_prefix, comment)]}
         self.check_directed_links()
+
+    def testDistinctNumbers(self):
+        self.links = {
+            1: ['-to #2'],
+            2: ['-from #12']}
+        self.mismatch = {2: ['-from #1'], 12: ['-to #2']}
+        self.check_directed_links()
+
+
+class TestCheckLinks(object):
+
+    def setup_method(self, method):
+        self.command = CheckPRs.__new__(CheckPRs)
+        self.command.prefetch_prs = self.prefetch_prs
+        self.visits = []
+        self.graph = {
+            1: ['-to #2'],
+            2: ['-from #1', '-to #3'],
+            3: ['-from #2', '-to #4'],
+            4: ['-from #3']}
+
+    def prefetch_prs(self, gh_repo, pr_numbers):
+        self.visits.append(sorted(pr_numbers))
+        self.command.links.update((x, self.graph[x]) for x in pr_numbers)
+
+    def testChain(self):
+        self.command.links = {1: self.graph[1]}
+        assert self.command.check_links(None) == {}
+        assert self.visits == [[2], [3], [4]]
+
+    @pytest.mark.parametrize("no_link_type", no_link_types)
+    def testBrokenChain(self, no_link_type):
+        self.graph[3] = no_link_type
+        self.command.links = {1: self.graph[1]}
+        assert self.command.check_links(None) == {3: ['-from #2']}
+        assert self.visits == [[2], [3]]
+
+
+class MockPull(object):
+
+    def __init__(self, number, updated_at, comments):
+        self.number = number
+        self.updated_at = updated_at
+        self.comments = comments
+
+    def has_merge_time(self):
+        return True
+
+    def parse(self, key):
+        self.comments.append(self.number)
+        if key == "no-rebase":
+            return []
+        return ["-to #%s" % (self.number + 1)]
+
+    @property
+    def pull(self):
+        return self
+
+
+class MockRepo(object):
+
+    def __init__(self, updated_at, comments):
+        self.updated_at = updated_at
+        self.comments = comments
+
+    def get_pull(self, number):
+        return MockPull(number, self.updated_at, self.comments)
+
+    def get_pulls_by_number(self, numbers, jobs=1):
+        self.listed = sorted(numbers)
+        return dict((x, self.get_pull(x)) for x in numbers)
+
+
+class TestLinksStore(object):
+
+    def setup_method(self, method):
+        self.command = CheckPRs.__new__(CheckPRs)
+        self.command.log = logging.getLogger("test")
+        self.command.links = {}
+        self.command.prs = {}
+        self.command.rebasedprs = set()
+        self.command.jobs = 1
+
+    def visit(self, tmpdir, updated_at):
+        parsed = []
+        self.command.prs = {}
+        self.command.links = {}
+        self.command.load_links(str(tmpdir), "repo.rebased")
+        self.command.visit_pr(MockRepo(updated_at, parsed), 1)
+        self.command.dump_links()
+        self.command.store.close()
+        return parsed
+
+    def test_store(self, tmpdir):
+        store = LinksStore(str(tmpdir.join("test.sqlite")))
+        store.put(1, ["-to #2"], True, "2018-01-01")
+        store.put(2, -1, False, None)
+        assert store.get(1) == (["-to #2"], True, False, "2018-01-01")
+        assert store.get(2) == (-1, False, False, None)
+        assert store.get(3) is None
+        store.set_rebased([1])
+        assert store.get_rebased() == {1: ["-to #2"]}
+        store.close()
+
+    def test_skip_unchanged(self, tmpdir, monkeypatch):
+        monkeypatch.setattr("scc.git.PullRequest", lambda x: x)
+        assert self.visit(tmpdir, "2018-01-01") == [1, 1]
+        assert self.visit(tmpdir, "2018-01-01") == []
+        assert self.command.links == {1: ["-to #2"]}
+        assert self.visit(tmpdir, "2018-01-02") == [1, 1]
+
+    def test_rebased(self, tmpdir, monkeypatch):
+        monkeypatch.setattr("scc.git.PullRequest", lambda x: x)
+        self.command.rebasedprs.add(1)
+        self.visit(tmpdir, "2018-01-01")
+        self.command.links = {}
+        self.command.load_links(str(tmpdir), "repo.rebased")
+        assert self.command.links == {1: ["-to #2"]}
+        self.command.store.close()
+
+    def test_legacy_cache(self, tmpdir):
+        with open(str(tmpdir.join("repo.rebased.cache")), "wb") as f:
+            pickle.dump({1: ["-to #2"], 2: ["-from #1"]}, f)
+        self.command.load_links(str(tmpdir), "repo.rebased")
+        assert self.command.links == {1: ["-to #2"], 2: ["-from #1"]}
+        self.command.store.close()
+        assert not tmpdir.join("repo.rebased.cache").check()
+        assert tmpdir.join("repo.rebased.cache.migrated").check()
+
+    def test_no_cache_dir(self):
+        self.command.load_links(None, "repo.rebased")
+        assert self.command.store is None
+        assert self.command.links == {}
+
+    def test_prefetch(self, tmpdir, monkeypatch):
+        monkeypatch.setattr("scc.git.PullRequest", lambda x: x)
+        parsed = []
+        self.command.jobs = 4
+        self.command.load_links(str(tmpdir), "repo.rebased")
+        repo = MockRepo("2018-01-01", parsed)
+        self.command.prefetch_prs(repo, [3, 1, 2, 1])
+        self.command.store.close()
+        assert repo.listed == [1, 2, 3]
+        assert sorted(self.command.prs) == [1, 2, 3]
+        assert self.command.links == dict(
+            (x, ["-to #%s" % (x + 1)]) for x in [1, 2, 3])
+        assert sorted(parsed) == [1, 1, 2, 2, 3, 3]
+
+
+class TestJobsArgument(object):
+
+    def parse_args(self, *args):
+        scc_parser, sub_parser = parsers()
+        CheckPRs(sub_parser)
+        return scc_parser.parse_args(
+            [CheckPRs.NAME] + list(args) + ["develop", "master"])
+
+    def test_default(self, monkeypatch):
+        monkeypatch.delenv("SCC_JOBS", raising=False)
+        assert self.parse_args().jobs == 8
+        assert self.parse_args("--jobs", "2").jobs == 2
+
+    def test_environment(self, monkeypatch):
+        monkeypatch.setenv("SCC_JOBS", "3")
+        assert self.parse_args().jobs == 3
+        assert self.parse_args("--jobs", "2").jobs == 2
@@ -19,10 +19,24 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import json
+import os
 import pytest
+import threading
+import time
 
-from yaclifw.framework import main, Stop
+from yaclifw.framework import main, parsers, Stop
+from scc import deploy, git
 from scc.deploy import Deploy
+from scc.git import hash_object
+
+
+def wait_empty(folder, timeout=10):
+    """Wait for the background removal of the content of a folder"""
+    end = time.time() + timeout
+    while folder.listdir() and time.time() < end:
+        time.sleep(0.05)
+    return not folder.listdir()
 
 
 class TestDeployInit(object):
@@ -125,3 +139,321 @@ class TestDeploy(object):
         else:
             assert tmpdir.join('test.live').join('link').check(file=1)
             assert tmpdir.join('test.live').join('link').read() == 'bar'
+
+
+class TestIncrementalDeploy(object):
+
+    def deploy(self, tmpdir, compare):
+        args = ["deploy", "--incremental", "--compare", compare,
+                str(tmpdir.join('test'))]
+        main("scc", args=args, items=[("deploy", Deploy)])
+
+    def init(self, tmpdir):
+        live = tmpdir.mkdir('test.live')
+        live.join('foo').write('foo')
+        live.join('bar').write('bar')
+        live.mkdir('sub').join('baz').write('baz')
+        live.join('foo').setmtime(1000000000)
+        tmpdir.join('test').mksymlinkto(live)
+        return dict((x, live.join(*x.split('/')).stat().ino)
+                    for x in ('foo', 'bar', 'sub/baz'))
+
+    @pytest.mark.parametrize('compare', ['mtime', 'hash'])
+    def testUnchangedFilesAreLinked(self, tmpdir, compare):
+        inodes = self.init(tmpdir)
+        tmp = tmpdir.mkdir('test.tmp')
+        tmp.join('foo').write('foo')
+        tmp.join('bar').write('new')
+        tmp.join('bar').setmtime(1000000000)
+        tmp.mkdir('sub').join('baz').write('baz')
+        tmp.join('sub').join('baz').setmtime(1000000000)
+        if compare == 'mtime':
+            tmp.join('foo').setmtime(1000000000)
+        self.deploy(tmpdir, compare)
+
+        live = tmpdir.join('test.live')
+        assert not tmp.check()
+        assert not tmpdir.join('test.live.new').check()
+        assert tmpdir.join('test').readlink() == str(live)
+        assert live.join('foo').read() == 'foo'
+        assert live.join('bar').read() == 'new'
+        assert live.join('sub').join('baz').read() == 'baz'
+        assert live.join('foo').stat().ino == inodes['foo']
+        assert live.join('bar').stat().ino != inodes['bar']
+        baz_linked = live.join('sub').join('baz').stat().ino == \
+            inodes['sub/baz']
+        assert baz_linked is (compare == 'hash')
+
+    def testRemovedFile(self, tmpdir):
+        self.init(tmpdir)
+        tmpdir.mkdir('test.tmp').join('foo').write('foo')
+        self.deploy(tmpdir, 'mtime')
+        live = tmpdir.join('test.live')
+        assert live.join('foo').read() == 'foo'
+        assert not live.join('bar').check()
+        assert not live.join('sub').check()
+
+
+class TestReleaseDeploy(object):
+
+    def deploy(self, tmpdir, *args):
+        args = ["deploy"] + list(args) + [str(tmpdir.join('test'))]
+        main("scc", args=args, items=[("deploy", Deploy)])
+
+    def release(self, tmpdir, content):
+        tmpdir.mkdir('test.tmp').join('foo').write(content)
+        self.deploy(tmpdir, "--releases", "2")
+
+    def releases(self, tmpdir):
+        return sorted(tmpdir.join('test.releases').listdir(
+            lambda x: x.check(dir=1)))
+
+    def init(self, tmpdir):
+        tmpdir.mkdir('test').join('foo').write('foo')
+        self.deploy(tmpdir, "--init", "--releases", "2")
+
+    def testInit(self, tmpdir):
+        self.init(tmpdir)
+        releases = self.releases(tmpdir)
+        assert len(releases) == 1
+        assert tmpdir.join('test').readlink() == str(releases[0])
+        assert tmpdir.join('test').join('foo').read() == 'foo'
+
+    def testNoInit(self, tmpdir):
+        tmpdir.mkdir('test.tmp')
+        with pytest.raises(Stop):
+            self.deploy(tmpdir, "--releases", "2")
+
+    def testInvalidReleases(self, tmpdir):
+        with pytest.raises(Stop):
+            self.deploy(tmpdir, "--releases", "0")
+
+    def testPrune(self, tmpdir):
+        self.init(tmpdir)
+        first = self.releases(tmpdir)[0]
+        for content in ('bar', 'baz'):
+            self.release(tmpdir, content)
+        releases = self.releases(tmpdir)
+        assert len(releases) == 2
+        assert first not in releases
+        assert not tmpdir.join('test.tmp').check()
+        assert tmpdir.join('test').readlink() == str(releases[-1])
+        assert tmpdir.join('test').join('foo').read() == 'baz'
+
+    def testRollback(self, tmpdir):
+        self.init(tmpdir)
+        self.release(tmpdir, 'bar')
+        self.deploy(tmpdir, "--rollback")
+        assert tmpdir.join('test').join('foo').read() == 'foo'
+        assert len(self.releases(tmpdir)) == 2
+        with pytest.raises(Stop):
+            self.deploy(tmpdir, "--rollback")
+
+    def testPruneAfterRollback(self, tmpdir):
+        self.init(tmpdir)
+        self.release(tmpdir, 'bar')
+        self.deploy(tmpdir, "--rollback")
+        tmpdir.mkdir('test.tmp').join('foo').write('baz')
+        self.deploy(tmpdir, "--releases", "1")
+        assert len(self.releases(tmpdir)) == 1
+        assert tmpdir.join('test').join('foo').read() == 'baz'
+
+
+class TestParallelCopy(object):
+
+    def deploy(self, tmpdir, jobs):
+        args = ["deploy", "--jobs", str(jobs), str(tmpdir.join('test'))]
+        main("scc", args=args, items=[("deploy", Deploy)])
+
+    @pytest.mark.parametrize('jobs', [1, 4])
+    def testTree(self, tmpdir, jobs):
+        tmpdir.mkdir('test.live').join('foo').write('foo')
+        tmpdir.join('test').mksymlinkto(tmpdir.join('test.live'))
+        tmp = tmpdir.mkdir('test.tmp')
+        for i in range(20):
+            tmp.ensure('dir%s' % (i % 3), 'file%s' % i).write(str(i))
+        tmp.join('link').mksymlinkto(tmp.join('dir0'))
+        self.deploy(tmpdir, jobs)
+
+        live = tmpdir.join('test.live')
+        for i in range(20):
+            assert live.join('dir%s' % (i % 3), 'file%s' % i).read() == str(i)
+        assert live.join('link').check(dir=1, link=0)
+        assert live.join('link', 'file0').read() == '0'
+        assert not live.join('foo').check()
+        assert not tmpdir.join('test.tmp').check()
+        assert wait_empty(tmpdir.join('test.trash'))
+
+    def testBackgroundRemoval(self, tmpdir, monkeypatch):
+        tmpdir.mkdir('test.live').join('foo').write('foo')
+        tmpdir.join('test').mksymlinkto(tmpdir.join('test.live'))
+        tmpdir.mkdir('test.tmp').join('foo').write('bar')
+        commands = []
+        monkeypatch.setattr(deploy.subprocess, "Popen",
+                            lambda args, **kwargs: commands.append(args))
+        self.deploy(tmpdir, 1)
+
+        # The old trees are left to a detached process
+        trashed = sorted(tmpdir.join('test.trash').listdir())
+        assert [x.basename.split('-')[0] for x in trashed] == [
+            'test.live', 'test.tmp']
+        assert len(commands) == 1
+        assert sorted(commands[0][3:]) == [str(x) for x in trashed]
+
+    def testBrokenSymlink(self, tmpdir, capsys):
+        tmpdir.mkdir('test.live')
+        tmpdir.join('test').mksymlinkto(tmpdir.join('test.live'))
+        link = tmpdir.mkdir('test.tmp').join('link')
+        link.mksymlinkto(tmpdir.join('missing'))
+        self.deploy(tmpdir, 4)
+        assert "Could not copy symbolic link %s" % link in \
+            capsys.readouterr()[1]
+
+    def testCopyError(self, tmpdir, monkeypatch):
+        tmpdir.mkdir('test.live')
+        tmpdir.join('test').mksymlinkto(tmpdir.join('test.live'))
+        tmp = tmpdir.mkdir('test.tmp')
+        for i in range(20):
+            tmp.join('file%s' % i).write(str(i))
+
+        def copyfile(self, src, dst, previous=None):
+            raise TypeError("copy failed")
+        monkeypatch.setattr(Deploy, "copyfile", copyfile)
+
+        errors = []
+
+        def deploy():
+            try:
+                self.deploy(tmpdir, 2)
+            except Exception, e:
+                errors.append(e)
+        thread = threading.Thread(target=deploy)
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        assert not thread.is_alive()
+        assert [type(e) for e in errors] == [TypeError]
+
+
+class TestManifest(object):
+
+    def deploy(self, tmpdir, *args):
+        args = ["deploy"] + list(args) + [str(tmpdir.join('test'))]
+        main("scc", args=args, items=[("deploy", Deploy)])
+
+    def manifest(self, tree):
+        return json.loads(tree.dirpath(tree.basename + '.manifest').read())
+
+    def init(self, tmpdir):
+        test = tmpdir.mkdir('test')
+        test.join('foo').write('foo')
+        test.ensure('sub', 'bar').write('bar')
+        for f in (test.join('foo'), test.join('sub', 'bar')):
+            f.setmtime(1000000000)
+        self.deploy(tmpdir, "--init", "--manifest")
+
+    def testInit(self, tmpdir):
+        self.init(tmpdir)
+        manifest = self.manifest(tmpdir.join('test.live'))
+        assert sorted(manifest) == ['foo', os.path.join('sub', 'bar')]
+        live_foo = tmpdir.join('test.live', 'foo')
+        assert manifest['foo'] == [3, 1000000000, hash_object(str(live_foo))]
+
+    def testNoManifest(self, tmpdir, monkeypatch):
+        self.init(tmpdir)
+        tmpdir.mkdir('test.tmp').join('foo').write('bar')
+        hashed = []
+        monkeypatch.setattr(git, "hash_object", hashed.append)
+        self.deploy(tmpdir)
+        assert hashed == []
+        assert not tmpdir.join('test.live.manifest').check()
+
+    def testDeltaDeploy(self, tmpdir, monkeypatch):
+        self.init(tmpdir)
+        tmp = tmpdir.mkdir('test.tmp')
+        tmp.join('foo').write('foo')
+        tmp.join('foo').setmtime(1000000000)
+        tmp.ensure('sub', 'bar').write('baz')
+        foo_inode = tmpdir.join('test.live', 'foo').stat().ino
+        hashed = []
+
+        def hash_file(filename):
+            hashed.append(os.path.basename(filename))
+            return hash_object(filename)
+        monkeypatch.setattr(deploy, "hash_object", hash_file)
+        monkeypatch.setattr(git, "hash_object", hash_file)
+        self.deploy(tmpdir, "--incremental", "--compare", "hash")
+
+        # Only the file modified since the previous deploy is hashed
+        assert hashed == ['bar']
+        live = tmpdir.join('test.live')
+        assert live.join('foo').stat().ino == foo_inode
+        assert live.join('sub', 'bar').read() == 'baz'
+        manifest = self.manifest(live)
+        assert manifest[os.path.join('sub', 'bar')][2] == \
+            hash_object(str(live.join('sub', 'bar')))
+
+        del hashed[:]
+        self.deploy(tmpdir, "--verify")
+        assert sorted(hashed) == ['bar', 'foo']
+
+    def testReleaseManifest(self, tmpdir):
+        tmpdir.mkdir('test').join('foo').write('foo')
+        self.deploy(tmpdir, "--init", "--releases", "1")
+        tmpdir.mkdir('test.tmp').join('foo').write('bar')
+        self.deploy(tmpdir, "--releases", "1")
+        release = tmpdir.join('test').realpath()
+        assert self.manifest(release)['foo'][2] == \
+            hash_object(str(release.join('foo')))
+        assert len(tmpdir.join('test.releases').listdir()) == 2
+
+    def testVerify(self, tmpdir, capsys):
+        self.init(tmpdir)
+        self.deploy(tmpdir, "--verify")
+        live = tmpdir.join('test.live')
+        live.join('foo').write('bar')
+        live.join('sub', 'bar').remove()
+        live.join('new').write('new')
+        with pytest.raises(Stop):
+            self.deploy(tmpdir, "--verify")
+        err = capsys.readouterr()[1]
+        assert "Modified file foo" in err
+        assert "Missing file %s" % os.path.join('sub', 'bar') in err
+        assert "Unexpected file new" in err
+
+    def testVerifyHashesAllFiles(self, tmpdir, monkeypatch):
+        self.init(tmpdir)
+        hashed = []
+
+        def hash_file(filename):
+            hashed.append(os.path.basename(filename))
+            return hash_object(filename)
+        monkeypatch.setattr(git, "hash_object", hash_file)
+        for i in range(2):
+            del hashed[:]
+            self.deploy(tmpdir, "--verify")
+            assert sorted(hashed) == ['bar', 'foo']
+
+    def testManifestCache(self, tmpdir, monkeypatch):
+        self.init(tmpdir)
+        assert tmpdir.join('test.blobcache').check(file=1)
+        hashed = []
+
+        def hash_file(filename):
+            hashed.append(os.path.basename(filename))
+            return hash_object(filename)
+        monkeypatch.setattr(git, "hash_object", hash_file)
+        command = Deploy(parsers()[1])
+        command.cache_path = str(tmpdir.join('test.blobcache'))
+        command.jobs = 1
+        command.dbg = command.log.debug
+        live = tmpdir.join('test.live')
+        manifest = command.build_manifest(str(live))
+        assert hashed == []
+        assert manifest == self.manifest(live)
+
+    def testVerifyNoManifest(self, tmpdir):
+        tmpdir.mkdir('test.live')
+        tmpdir.join('test').mksymlinkto(tmpdir.join('test.live'))
+        with pytest.raises(Stop):
+            self.deploy(tmpdir, "--verify")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2014 University of Dundee & Open Microscopy Environment
+# All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from yaclifw.framework import parsers
+
+from github import Github
+from github.Issue import Issue
+from github.NamedUser import NamedUser
+from github.Organization import Organization
+from github.PaginatedList import PaginatedList
+from github.Repository import Repository
+
+from scc.git import ExternalIssues, GHManager
+from Mock import MoxTestBase
+
+
+class TestExternalIssues(MoxTestBase):
+
+    def setup_method(self, method):
+        super(TestExternalIssues, self).setup_method(method)
+        self.scc_parser, self.sub_parser = parsers()
+        self.command = ExternalIssues(self.sub_parser)
+        self.command.gh = self.mox.CreateMock(GHManager)
+        self.org = self.mox.CreateMock(Organization)
+        self.org.login = "mock_org"
+        self.members = set(["member"])
+        self.query = "is:open is:issue user:mock_org archived:false"
+
+    def create_repo(self, name, archived=False):
+        repo = self.mox.CreateMock(Repository)
+        repo.name = name
+        repo.raw_data = {"archived": archived}
+        return repo
+
+    def create_issue(self, number, login, repo=None, pull_request=None):
+        issue = self.mox.CreateMock(Issue)
+        issue.title = "Issue %s" % number
+        issue.html_url = "https://github.com/mock_org/%s" % number
+        issue.user = self.mox.CreateMock(NamedUser)
+        issue.user.login = login
+        issue.repository = repo
+        issue.pull_request = pull_request
+        return issue
+
+    def find_external_issues(self):
+        return list(self.command.find_external_issues(
+            self.org, self.members))
+
+    def test_search(self):
+        repo = self.create_repo("repo")
+        results = self.mox.CreateMock(PaginatedList)
+        self.command.gh.search_issues(self.query).AndReturn(results)
+        self.command.gh.get_search_count(results).AndReturn(2)
+        self.command.gh.iter_search(results).AndReturn(iter([
+            self.create_issue(1, "member", repo),
+            self.create_issue(2, "external", repo)]))
+        self.mox.ReplayAll()
+
+        assert self.find_external_issues() == [
+            ' - [???] [\\[repo\\] Issue 2 ](https://github.com/mock_org/2)'
+            ' (external)']
+
+    def test_search_limit(self):
+        repo1 = self.create_repo("repo1")
+        repo2 = self.create_repo("repo2", archived=True)
+        repo3 = self.create_repo("repo3")
+        results = self.mox.CreateMock(PaginatedList)
+        self.command.gh.search_issues(self.query).AndReturn(results)
+        self.command.gh.get_search_count(results).AndReturn(1001)
+        self.org.get_repos().AndReturn([repo1, repo2, repo3])
+        repo1.get_issues(state="open").AndReturn([
+            self.create_issue(1, "external"),
+            self.create_issue(2, "external", pull_request=object())])
+        repo3.get_issues(state="open").AndReturn([
+            self.create_issue(3, "member"),
+            self.create_issue(4, "external")])
+        self.mox.ReplayAll()
+
+        assert self.find_external_issues() == [
+            ' - [???] [\\[repo1\\] Issue 1 ](https://github.com/mock_org/1)'
+            ' (external)',
+            ' - [???] [\\[repo3\\] Issue 4 ](https://github.com/mock_org/4)'
+            ' (external)']
+
+
+class TestIterSearch(MoxTestBase):
+
+    def test_pages(self, monkeypatch):
+        monkeypatch.setattr(GHManager, "create_instance", lambda self: None)
+        gh = GHManager(dont_ask=True)
+        gh.github = self.mox.CreateMock(Github)
+        gh.github.per_page = 2
+        waits = []
+        gh.search_throttle.wait = lambda: waits.append(1)
+        results = self.mox.CreateMock(PaginatedList)
+        results.get_page(0).AndReturn([1, 2])
+        results.get_page(1).AndReturn([3])
+        self.mox.ReplayAll()
+
+        assert list(gh.iter_search(results)) == [1, 2, 3]
+        assert len(waits) == 2
@@ -31,6 +31,7 @@ from github.PaginatedList import PaginatedList
 
 from scc.git import GHManager
 from scc.git import GitHubRepository
+import datetime
 import pytest
 from Mock import MoxTestBase
 
@@ -130,6 +131,82 @@ class TestGithubRepository(MoxTestBase):
         assert self.gh_repo.get_pulls_by_base("master") == \
             self.pulls[:-1]
 
+    def create_closed_pulls(self, numbers):
+        for i, number in enumerate(numbers):
+            pullrequest = self.mox.CreateMock(PullRequest)
+            pullrequest.number = number
+            pullrequest.updated_at = datetime.datetime(2018, 1, 10 - i)
+            self.pulls.append(pullrequest)
+
+    def stub_pulls_pages(self, pages):
+        requested = []
+
+        def get_pulls_page(page, **parameters):
+            assert parameters == {
+                "state": "closed", "sort": "updated", "direction": "desc"}
+            requested.append(page)
+            return pages[page] if page < len(pages) else []
+        self.gh_repo.get_pulls_page = get_pulls_page
+        return requested
+
+    @pytest.mark.parametrize('since', [None, datetime.datetime(2018, 1, 8)])
+    def test_get_pulls_by_number(self, since):
+        self.create_closed_pulls([5, 1, 4, 3, 2])
+        missing = self.mox.CreateMock(PullRequest)
+        if since:
+            self.repo.get_pull(3).AndReturn(missing)
+        self.setup_repo()
+        requested = self.stub_pulls_pages([self.pulls])
+        pulls = self.gh_repo.get_pulls_by_number([1, 3, 4], since=since)
+        assert requested == [0]
+        assert pulls[1] == self.pulls[1]
+        assert pulls[4] == self.pulls[2]
+        assert pulls[3] == (missing if since else self.pulls[3])
+
+    def test_get_pulls_by_number_page_limit(self):
+        self.create_closed_pulls([5, 1, 6, 7, 4])
+        missing = self.mox.CreateMock(PullRequest)
+        self.repo.get_pull(3).AndReturn(missing)
+        self.repo.get_pull(4).AndReturn(missing)
+        self.setup_repo()
+        requested = self.stub_pulls_pages(
+            [self.pulls[0:2], self.pulls[2:4], self.pulls[4:]])
+        pulls = self.gh_repo.get_pulls_by_number([1, 3, 4])
+        # Two pull requests are still missing after the first page
+        assert requested == [0, 1]
+        assert pulls == {1: self.pulls[1], 3: missing, 4: missing}
+
+    def test_get_pulls_by_number_last_page(self):
+        self.create_closed_pulls([5, 1])
+        missing = self.mox.CreateMock(PullRequest)
+        self.repo.get_pull(98).AndReturn(missing)
+        self.repo.get_pull(99).AndReturn(missing)
+        self.setup_repo()
+        requested = self.stub_pulls_pages([self.pulls])
+        pulls = self.gh_repo.get_pulls_by_number([1, 98, 99])
+        # The second page is empty
+        assert requested == [0, 1]
+        assert pulls == {1: self.pulls[1], 98: missing, 99: missing}
+
+    def test_get_pulls_page(self):
+        pulls_list = self.mox.CreateMock(PaginatedList)
+        self.repo.get_pulls(state="closed").AndReturn(pulls_list)
+        pulls_list.get_page(1).AndReturn([])
+        self.setup_repo()
+        assert self.gh_repo.get_pulls_page(1, state="closed") == []
+
+    def test_get_pulls_by_number_empty(self):
+        self.setup_repo()
+        assert self.gh_repo.get_pulls_by_number([]) == {}
+
+    def test_get_lazy_issue(self):
+        self.repo.url = "https://api.github.com/repos/mock_user/mock_repo"
+        self.repo._requester = None
+        self.setup_repo()
+        issue = self.gh_repo.get_lazy_issue(1)
+        assert issue.number == 1
+        assert issue.url == self.repo.url + "/issues/1"
+
     def testGetMilestoneOpen(self):
         self.create_milestones(["open-1", "open-2"])
         self.repo.get_milestones(state="open").AndReturn(self.milestones)
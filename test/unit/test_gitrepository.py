@@ -19,12 +19,21 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-from scc.git import GitRepository
+from scc.git import ChangedFiles, GitRepository, MergeReport
+from scc.git import AlreadyMerged, FINGERPRINT_TRAILER
+from scc.git import BlobCache, hash_object, hash_objects
+from scc import git
+from yaclifw.framework import parsers
 import pytest
 from Mock import MoxTestBase
 
+import json
 import logging
+import os
+import shutil
 import subprocess
+import tempfile
+from StringIO import StringIO
 
 
 class MockGitRepository(GitRepository):
@@ -39,6 +48,11 @@ class MockGitRepository(GitRepository):
 
         self.gh = gh
         self.path = path
+        self.merge_bases = {}
+        self.pair_changes = {}
+        self.report = MergeReport()
+        self.repository_config = None
+        self.fetch_options = {}
 
     def __del__(self):
         pass
@@ -77,7 +91,8 @@ class TestGitRepository(MoxTestBase):
         self.mox.StubOutWithMock(subprocess, 'Popen')
         p = MockPopen(rcode, 'out', 'err')
         subprocess.Popen(
-            ('cmd', 'a', 'b'), stdout=stdout, stderr=stderr).AndReturn(p)
+            ('cmd', 'a', 'b'), stdout=stdout, stderr=stderr,
+            close_fds=True).AndReturn(p)
         return repo, p
 
     @pytest.mark.parametrize('no_wait', [True, False])
@@ -139,3 +154,486 @@ class TestGitRepository(MoxTestBase):
         assert p.stdout.n_close == 0
         assert p.stderr.n_close == 0
         assert p.n_wait == 1
+
+
+class MockPull(object):
+
+    def __init__(self, number, sha):
+        self.number = number
+        self.sha = sha
+
+    def get_number(self):
+        return self.number
+
+    def get_title(self):
+        return "title"
+
+    def get_sha(self):
+        return self.sha
+
+
+class MockOrigin(object):
+
+    def __init__(self, candidate_pulls):
+        self.user_name = "user"
+        self.repo_name = "repo"
+        self.candidate_pulls = candidate_pulls
+
+
+class GitRepositoryTest(object):
+
+    def setup_method(self, method):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def git(self, *args):
+        return self.repo.communicate("git", *args).strip()
+
+    def init_repo(self, tmpdir):
+        self.repo = MockGitRepository(None, str(tmpdir))
+        self.git("init", "-q")
+        self.git("config", "user.name", "test")
+        self.git("config", "user.email", "test@example.com")
+        return self.commit("base")
+
+    def commit(self, name, content=None):
+        with open(os.path.join(self.repo.path, name), "w") as f:
+            f.write(content or name)
+        self.git("add", name)
+        self.git("commit", "-q", "-m", name)
+        return self.git("rev-parse", "HEAD")
+
+    def branch(self, name, head, filename=None):
+        self.git("checkout", "-q", "-b", name, head)
+        return self.commit(filename or name, content=name)
+
+
+class TestMergePrefix(GitRepositoryTest):
+
+    def setup_method(self, method):
+        super(TestMergePrefix, self).setup_method(method)
+        self.base = self.init_repo(self.tmpdir)
+        self.shas = [self.branch("pr%s" % i, self.base) for i in range(3)]
+        self.git("checkout", "-q", "--detach", self.base)
+        for i, sha in enumerate(self.shas):
+            self.git("merge", "-q", "--no-ff", "-m",
+                     "merge: PR %s (title)" % i, sha)
+        self.git("tag", "previous")
+        self.git("checkout", "-q", "--detach", self.base)
+
+    def find_merge_prefix(self, shas):
+        pulls = [MockPull(i, sha) for i, sha in enumerate(shas)]
+        self.repo.origin = MockOrigin(pulls)
+        prefix = self.repo.find_merge_prefix("previous")
+        return [x[0] for x in prefix]
+
+    def test_unchanged(self):
+        assert len(self.find_merge_prefix(self.shas)) == 3
+
+    def test_new_pull(self):
+        assert len(self.find_merge_prefix(self.shas + [self.base])) == 3
+
+    def test_changed_pull(self):
+        shas = [self.shas[0], self.base, self.shas[2]]
+        assert len(self.find_merge_prefix(shas)) == 1
+
+    def test_new_base(self):
+        self.commit("upstream")
+        assert self.find_merge_prefix(self.shas) == []
+
+    def test_unknown_ref(self):
+        self.repo.origin = MockOrigin([])
+        assert self.repo.find_merge_prefix("unknown") == []
+
+
+class TestFingerprint(GitRepositoryTest):
+
+    def setup_method(self, method):
+        super(TestFingerprint, self).setup_method(method)
+        self.remote = os.path.join(self.tmpdir, "remote")
+        self.local = os.path.join(self.tmpdir, "local")
+        os.mkdir(self.remote)
+        os.mkdir(self.local)
+        self.init_repo(self.remote)
+        self.fingerprint = "0123456789abcdef0123456789abcdef01234567"
+        self.git("checkout", "-q", "-b", "merge/test")
+        self.git("commit", "-q", "--allow-empty", "-m",
+                 "merge\n\nMerged PRs:\n\n%s %s" % (
+                     FINGERPRINT_TRAILER, self.fingerprint))
+        self.init_repo(self.local)
+
+    def test_fingerprint(self):
+        assert self.repo.get_fingerprint(
+            self.remote, "merge/test") == self.fingerprint
+
+    def test_no_fingerprint(self):
+        assert self.repo.get_fingerprint(self.remote, "master") is None
+
+    def test_missing_branch(self):
+        assert self.repo.get_fingerprint(self.remote, "missing") is None
+
+    def test_missing_remote(self):
+        missing = os.path.join(self.tmpdir, "missing")
+        assert self.repo.get_fingerprint(missing, "merge/test") is None
+
+
+class TestBatchMerge(GitRepositoryTest):
+
+    def setup_method(self, method):
+        super(TestBatchMerge, self).setup_method(method)
+        self.base = self.init_repo(self.tmpdir)
+        self.repo.origin = MockOrigin([])
+        self.repo.pull_merged = lambda pullrequest, comment=False: None
+        self.repo.pull_conflicting = lambda *args, **kwargs: None
+
+    def merge(self, filenames, upstream_file=None):
+        pulls = []
+        for i, filename in enumerate(filenames):
+            sha = self.branch("pr%s" % i, self.base, filename=filename)
+            pulls.append(MockPull(i, sha))
+        self.git("checkout", "-q", "--detach", self.base)
+        if upstream_file:
+            self.commit(upstream_file, content="upstream")
+        statuses = self.repo.merge_pulls_batch(
+            pulls, all_changed_files=ChangedFiles())
+        merges = self.git("rev-list", "--merges", "HEAD").split()
+        return statuses, len(merges)
+
+    def test_no_conflict(self):
+        statuses, merges = self.merge(["a", "b", "c", "d"])
+        assert statuses == [True] * 4
+        assert merges == 1
+
+    def test_conflict(self):
+        statuses, merges = self.merge(["a", "shared", "shared", "d"])
+        assert statuses == [True, True, False, True]
+        assert merges == 2
+
+    def test_conflict_with_upstream(self):
+        statuses, merges = self.merge(
+            ["shared", "b", "c", "d"], upstream_file="shared")
+        assert statuses == [False, True, True, True]
+        assert merges == 2
+
+    def test_report(self):
+        stream = StringIO()
+        self.repo.report = MergeReport(stream)
+        self.merge(["a", "shared", "shared", "d"])
+        records = [json.loads(x) for x in stream.getvalue().splitlines()]
+        assert [x["event"] for x in records] == ["merge"] * 5
+        assert [(x["pulls"], x["merged"]) for x in records] == [
+            ([0, 1, 2, 3], False), ([0, 1], True), ([2, 3], False),
+            ([2], False), ([3], True)]
+        assert all(x["duration"] >= 0 for x in records)
+
+    @pytest.mark.parametrize('batch', [True, False])
+    def test_trial_merge(self, batch):
+        conflicting = []
+        self.repo.pull_conflicting = \
+            lambda pullrequest, conflict_files, **kwargs: \
+            conflicting.append((pullrequest.get_number(), conflict_files))
+        pulls = [MockPull(i, self.branch("pr%s" % i, self.base, filename=x))
+                 for i, x in enumerate(["a", "shared", "c", "shared"])]
+        self.git("checkout", "-q", "--detach", self.base)
+        self.commit("shared", content="upstream")
+        self.repo.origin = MockOrigin(pulls)
+        merged, conflicts = self.repo.merge_pulls(batch=batch, jobs=2)
+        assert [x.get_number() for x in merged] == [0, 2]
+        assert conflicting == [(1, ["shared"]), (3, ["shared"])]
+        assert self.git("worktree", "list").count("\n") == 0
+
+    def test_trial_conflict_retried(self):
+        pulls = [MockPull(i, self.branch("pr%s" % i, self.base, filename=x))
+                 for i, x in enumerate(["a", "b"])]
+        self.git("checkout", "-q", "--detach", self.base)
+        self.repo.origin = MockOrigin(pulls)
+        self.repo.trial_merge_pulls = \
+            lambda pulls, upstream, jobs: {pulls[1]: ["b"]}
+        merged, conflicts = self.repo.merge_pulls(jobs=2)
+        assert [x.get_number() for x in merged] == [0, 1]
+        assert conflicts == []
+
+    def test_reuse_octopus_merge(self):
+        self.merge(["a", "b", "c"])
+        self.git("tag", "previous")
+        self.git("checkout", "-q", "--detach", self.base)
+        pulls = [MockPull(i, self.git("rev-parse", "pr%s" % i))
+                 for i in range(3)]
+        self.repo.origin = MockOrigin(pulls)
+        assert len(self.repo.find_merge_prefix("previous")) == 3
+
+
+class TestListChanges(GitRepositoryTest):
+
+    def setup_method(self, method):
+        super(TestListChanges, self).setup_method(method)
+        self.base = self.init_repo(self.tmpdir)
+        self.shas = [self.branch("pr%s" % i, self.base, filename=filename)
+                     for i, filename in enumerate(["a", "b", "base"])]
+        self.git("checkout", "-q", "--detach", self.base)
+        self.upstream = self.commit("upstream")
+
+    def test_merged_files(self):
+        files = self.repo.list_merged_files_batch(self.shas, self.upstream)
+        for sha in self.shas:
+            assert files[sha] == self.repo.list_merged_files(
+                sha, upstream=self.upstream)
+
+    def test_upstream_changes(self):
+        self.repo.list_merged_files_batch(self.shas, self.upstream)
+        # Cached results are reused without spawning git
+        self.repo.communicate = None
+        for sha in self.shas:
+            assert self.repo.list_upstream_changes(
+                sha, upstream=self.upstream) == set(["upstream"])
+
+    def test_unchanged_pair(self):
+        assert self.repo.list_changes(
+            [(self.base, self.base), (self.base, self.shas[0])]) == \
+            [set(), set(["a"])]
+
+
+class TestFetch(GitRepositoryTest):
+
+    def setup_method(self, method):
+        super(TestFetch, self).setup_method(method)
+        self.remote = os.path.join(self.tmpdir, "remote")
+        self.local = os.path.join(self.tmpdir, "local")
+        os.mkdir(self.remote)
+        os.mkdir(self.local)
+        self.base = self.init_repo(self.remote)
+        self.pr = self.branch("pr", self.base)
+        self.git("checkout", "-q", "master")
+        for i in range(5):
+            self.commit("upstream%s" % i)
+        self.init_repo(self.local)
+
+    def test_fetch_args(self):
+        self.repo.repository_config = {
+            "fetch": {"filter": "blob:none", "depth": 10}}
+        self.repo.fetch_options = {
+            "depth": 5, "shallow-since": None,
+            "negotiation-tip": ["origin/master", "origin/develop"]}
+        assert self.repo.get_fetch_args() == [
+            "--filter=blob:none", "--depth=5",
+            "--negotiation-tip=origin/master",
+            "--negotiation-tip=origin/develop"]
+
+    def test_deepen(self):
+        url = "file://%s" % self.remote
+        self.repo.fetch_options = {"depth": 1}
+        self.repo.fetch(url, "master:refs/remotes/origin/master",
+                        "pr:refs/remotes/origin/pr")
+        assert self.repo.is_shallow()
+        assert not self.repo.has_merge_base("origin/master", self.pr)
+        self.repo.deepen([self.pr], upstream="origin/master", remotes=[url])
+        assert self.git("merge-base", "origin/master", self.pr) == self.base
+
+
+class TestBranchingPoint(GitRepositoryTest):
+
+    def setup_method(self, method):
+        super(TestBranchingPoint, self).setup_method(method)
+        self.base = self.init_repo(self.tmpdir)
+        self.topic = self.branch("topic", self.base, filename="topic1")
+        self.commit("topic2")
+        self.git("checkout", "-q", "master")
+        for i in range(3):
+            self.commit("upstream%s" % i)
+        self.git("merge", "-q", "--no-ff", "-m", "merge", "topic")
+
+    def test_branching_point(self):
+        assert self.repo.find_branching_point("topic", "master") == self.base
+        assert self.repo.find_branching_point("master", "topic") == self.base
+
+    def test_same_branch(self):
+        head = self.git("rev-parse", "HEAD")
+        assert self.repo.find_branching_point("master", "HEAD") == head
+
+    def test_no_branching_point(self):
+        self.git("checkout", "-q", "--orphan", "orphan")
+        self.commit("orphan")
+        with pytest.raises(Exception):
+            self.repo.find_branching_point("orphan", "master")
+
+    def test_unknown_commit(self):
+        with pytest.raises(Exception):
+            self.repo.find_branching_point("unknown", "master")
+
+
+class TestNotes(GitRepositoryTest):
+
+    def setup_method(self, method):
+        super(TestNotes, self).setup_method(method)
+        self.shas = [self.init_repo(self.tmpdir)]
+        self.shas += [self.commit("commit%s" % i) for i in range(3)]
+        for i, note in ((1, "See gh-1"), (2, "n/a\nmultiline")):
+            self.git("notes", "--ref", "see_also/develop", "add", "-m", note,
+                     self.shas[i])
+
+    def test_get_notes(self):
+        notes, missing = self.repo.get_notes(
+            ["refs/notes/see_also/develop", "refs/notes/see_also/missing"])
+        assert notes == {self.shas[1]: "See gh-1\n",
+                         self.shas[2]: "n/a\nmultiline\n"}
+        assert missing == {}
+
+    def test_iter_log(self):
+        records = list(self.repo.iter_log(
+            "%H%n%s", "--first-parent", "%s..HEAD" % self.shas[0]))
+        assert records == ["%s\ncommit%s" % (self.shas[i], i - 1)
+                           for i in (3, 2, 1)]
+
+    def test_iter_log_closed(self):
+        log = self.repo.iter_log("%H", "HEAD")
+        assert next(log) == self.shas[3]
+        log.close()
+
+
+class TestAlreadyMerged(GitRepositoryTest):
+
+    def setup_method(self, method):
+        super(TestAlreadyMerged, self).setup_method(method)
+        base = self.init_repo(self.tmpdir)
+        self.branch("merged", base)
+        self.branch("unmerged", base)
+        self.git("checkout", "-q", "master")
+        self.git("merge", "-q", "--no-ff", "-m", "merge", "merged")
+        self.scc_parser, self.sub_parser = parsers()
+        self.command = AlreadyMerged(self.sub_parser)
+
+    def test_already_merged(self, capsys):
+        args = self.scc_parser.parse_args(
+            [AlreadyMerged.NAME, "master", "refs/heads"])
+        self.command.already_merged(args, self.repo)
+        lines = capsys.readouterr()[0].splitlines()
+        branches = dict((x.split()[3], x) for x in lines)
+        assert sorted(branches) == ["master", "merged"]
+        assert branches["merged"].endswith("   --- merged")
+
+
+class TestHashObjects(GitRepositoryTest):
+
+    def setup_method(self, method):
+        super(TestHashObjects, self).setup_method(method)
+        self.init_repo(self.tmpdir)
+        self.files = []
+        for i, size in enumerate((0, 10, 4096)):
+            self.files.append(os.path.join(self.tmpdir, "file%s" % i))
+            with open(self.files[-1], "wb") as f:
+                f.write(os.urandom(size))
+
+    def expected(self):
+        return [self.git("hash-object", x) for x in self.files]
+
+    @pytest.mark.parametrize('threshold', [1, 1024 * 1024])
+    def test_hash_object(self, monkeypatch, threshold):
+        monkeypatch.setattr(git, "MMAP_THRESHOLD", threshold)
+        assert [hash_object(x) for x in self.files] == self.expected()
+
+    @pytest.mark.parametrize('jobs', [1, 4])
+    def test_hash_objects(self, jobs):
+        assert hash_objects(self.files, jobs=jobs) == self.expected()
+
+    def test_cache(self, monkeypatch):
+        hashed = []
+
+        def hash_file(filename):
+            hashed.append(filename)
+            return hash_object(filename)
+        monkeypatch.setattr(git, "hash_object", hash_file)
+        path = os.path.join(self.tmpdir, "cache.sqlite")
+        cache = BlobCache(path)
+        assert hash_objects(self.files, cache=cache) == self.expected()
+        assert len(hashed) == 3
+        cache.close()
+
+        with open(self.files[1], "wb") as f:
+            f.write("modified")
+        cache = BlobCache(path)
+        del hashed[:]
+        assert hash_objects(self.files, cache=cache) == self.expected()
+        assert hashed == [self.files[1]]
+        cache.close()
+
+    def test_cache_prune(self):
+        cache = BlobCache(os.path.join(self.tmpdir, "cache.sqlite"))
+        hash_objects(self.files, cache=cache)
+        os.remove(self.files[0])
+        cache.prune()
+        rows = cache.db.execute("SELECT path FROM blobs").fetchall()
+        assert sorted(x[0] for x in rows) == sorted(
+            os.path.abspath(x) for x in self.files[1:])
+        cache.close()
+
+
+class TestMergeReport(object):
+
+    def test_timed_error(self):
+        stream = StringIO()
+        report = MergeReport(stream)
+        with pytest.raises(ValueError):
+            with report.timed("fetch", repo="mock"):
+                raise ValueError("fetch failed")
+        record = json.loads(stream.getvalue())
+        assert record["event"] == "fetch"
+        assert record["repo"] == "mock"
+        assert record["error"] == "fetch failed"
+        assert record["duration"] >= 0
+
+    def test_log_merge(self):
+        stream = StringIO()
+        report = MergeReport(stream)
+        record = report.emit(
+            "merged", repo="mock",
+            merged_pulls=[{"pull": 1, "login": "user", "title": "Fix"}],
+            conflicting_pulls=[{"pull": 2, "login": "user", "title": "Add"}],
+            merged_branches=["topic"], conflicting_branches=[])
+        assert json.loads(stream.getvalue()) == record
+        repo = MockGitRepository(None, None)
+        assert repo.log_merge(record) == (
+            "Merged PRs:\n  # PR 1 user 'Fix'\n\n"
+            "Merged branches:\n  # topic\n\n\n"
+            "Conflicting PRs (not included):\n  # PR 2 user 'Add'\n")
+
+
+class TestChangedFiles(object):
+
+    def setup_method(self, method):
+        self.pulls = [MockPull(i, "sha%s" % i) for i in range(3)]
+        self.changed_files = ChangedFiles()
+        self.changed_files[self.pulls[0]] = ["a/b/c.txt", "d.txt"]
+        self.changed_files[self.pulls[1]] = ["a/b/c.txt", "a/e.txt"]
+        self.changed_files[self.pulls[2]] = ["f.txt"]
+
+    def test_dictionary(self):
+        assert len(self.changed_files) == 3
+        assert self.pulls[0] in self.changed_files
+        assert self.changed_files[self.pulls[2]] == set(["f.txt"])
+
+    @pytest.mark.parametrize('path,indices', [
+        ("a/b/c.txt", [0, 1]), ("d.txt", [0]), ("a/e.txt", [1]),
+        ("a", [0, 1]), ("a/", [0, 1]), ("a/b", [0, 1]), ("g.txt", []),
+        (None, [])])
+    def test_find(self, path, indices):
+        pulls = [self.pulls[i] for i in indices]
+        assert self.changed_files.find(path) == pulls
+
+    def test_replace(self):
+        self.changed_files[self.pulls[1]] = ["f.txt"]
+        assert self.changed_files.find("a/e.txt") == []
+        assert self.changed_files.find("a") == [self.pulls[0]]
+        assert self.changed_files.find("f.txt") == [
+            self.pulls[2], self.pulls[1]]
+
+    def test_possible_conflicts(self):
+        repo = MockGitRepository(None, '.')
+        conflicts, upstream_conflicts = repo.get_possible_conflicts(
+            self.pulls[1], ["a/b/c.txt", "d.txt"], self.changed_files, None)
+        assert conflicts == {
+            self.pulls[0]: set(["a/b/c.txt"]), None: ["d.txt"]}
+        assert upstream_conflicts == set()
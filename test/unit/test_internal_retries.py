@@ -20,6 +20,7 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 from github.AuthenticatedUser import AuthenticatedUser
+from github.Organization import Organization
 from github.Repository import Repository
 from github.GithubException import GithubException
 from github.Issue import Issue
@@ -130,6 +131,29 @@ class TestGHManagerGetUser(TestInternalRetries, InternalRetriesHelper):
         return self.user
 
 
+class TestGHManagerGetSubscriptions(TestInternalRetries,
+                                    InternalRetriesHelper):
+
+    def setup_method(self, method):
+        super(TestGHManagerGetSubscriptions, self).setup_method(method)
+        self.repo.full_name = "mock/mock"
+
+    def generate_errors(self, error, nerrors):
+        for i in range(nerrors):
+            self.gh.get_user().AndReturn(self.user)
+            self.user.get_subscriptions().AndRaise(error)
+
+    def mock_calls(self):
+        self.gh.get_user().AndReturn(self.user)
+        self.user.get_subscriptions().AndReturn([self.repo])
+
+    def run_function(self):
+        return self.gh_manager.get_subscriptions()
+
+    def get_output(self):
+        return set(["mock/mock"])
+
+
 class TestGHManagerGetOrganization(TestInternalRetries,
                                    InternalRetriesHelper):
 
@@ -147,6 +171,30 @@ class TestGHManagerGetOrganization(TestInternalRetries,
         return self.org
 
 
+class TestGHManagerGetMembers(TestInternalRetries, InternalRetriesHelper):
+
+    def setup_method(self, method):
+        super(TestGHManagerGetMembers, self).setup_method(method)
+        self.org = self.mox.CreateMock(Organization)
+        self.org.login = "mock"
+
+    def generate_errors(self, error, nerrors):
+        for i in range(nerrors):
+            self.org.get_members().AndRaise(error)
+
+    def mock_calls(self):
+        self.org.get_members().AndReturn([self.user])
+
+    def run_function(self):
+        members = self.gh_manager.get_members(self.org)
+        # The membership is cached
+        assert self.gh_manager.get_members(self.org) is members
+        return members
+
+    def get_output(self):
+        return set(["mock"])
+
+
 class TestGHManagerGetRepo(TestInternalRetries, InternalRetriesHelper):
 
     def generate_errors(self, error, nerrors):
@@ -139,6 +139,11 @@ class TestPullRequest(MoxTestBase):
     def test_get_number(self):
         assert self.pr.get_number() == self.pull.number
 
+    @pytest.mark.parametrize('merged_at', [None, "2018-01-01T00:00:00Z"])
+    def test_has_merge_time(self, merged_at):
+        self.pull.merged_at = merged_at
+        assert self.pr.has_merge_time() == (merged_at is not None)
+
     def test_get_issue(self):
         self.create_issue()
         self.mox.ReplayAll()
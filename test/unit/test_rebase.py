@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#
+# Copyright (C) 2014 University of Dundee & Open Microscopy Environment
+# All Rights Reserved.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+from yaclifw.framework import parsers, Stop
+
+from github import GithubException
+
+from scc.git import Rebase, Throttle
+from Mock import MockPR, parametrize_jobs
+import pytest
+
+
+class MockGH(object):
+
+    def get_login(self):
+        return "mock_user"
+
+
+class MockGitRepository(object):
+
+    def __init__(self, remote_branches=()):
+        self.remote_branches = set(remote_branches)
+        self.rebasing = False
+        self.aborted = 0
+        self.checkouts = []
+        self.deleted = []
+
+    def abort_rebase(self):
+        if not self.rebasing:
+            raise Exception("No rebase in progress")
+        self.rebasing = False
+        self.aborted += 1
+
+    def checkout_branch(self, branch):
+        self.checkouts.append(branch)
+
+    def delete_local_branch(self, branch, force=False):
+        self.deleted.append(branch)
+
+    def has_remote_branch(self, branch, remote="origin"):
+        assert remote == "mock_user"
+        return branch in self.remote_branches
+
+
+class TestRebase(object):
+
+    def setup_method(self, method):
+        self.scc_parser, self.sub_parser = parsers()
+        self.command = Rebase(self.sub_parser)
+        self.command.gh = MockGH()
+        self.command.main_repo = MockGitRepository(["rebased/develop/5"])
+
+    def parse_args(self, *args):
+        return self.scc_parser.parse_args([Rebase.NAME] + list(args))
+
+    def test_parse_args(self):
+        args = self.parse_args("1", "2", "3", "develop")
+        assert args.PR == [1, 2, 3]
+        assert args.newbase == "develop"
+
+    def test_continue_multiple_prs(self):
+        args = self.parse_args("--continue", "1", "2", "develop")
+        with pytest.raises(Stop) as exc:
+            self.command(args)
+        assert exc.value.rc == 23
+
+    def test_local_rebases(self):
+        main_repo = self.command.main_repo
+
+        def local_rebase(pr_number, newbase, remote):
+            if pr_number == 2:
+                main_repo.rebasing = True
+                raise Stop(20, "Rebasing failed")
+            if pr_number == 3:
+                raise Stop(18, "Branch exists")
+            if pr_number == 6:
+                main_repo.rebasing = True
+                raise OSError("git failed")
+            return MockPR(pr_number), "rebased/%s/%s" % (newbase, pr_number)
+
+        self.command.local_rebase = local_rebase
+        rebased, failed = self.command.local_rebases(
+            [1, 2, 3, 4, 5, 6], "develop", "master")
+        assert [x[1] for x in rebased] == [
+            "rebased/develop/1", "rebased/develop/4"]
+        assert failed == [2, 3, 5, 6]
+        assert main_repo.aborted == 2
+        assert main_repo.checkouts == ["master"] * 4
+        assert main_repo.deleted == ["rebased/develop/5"]
+
+    def test_rebase_prs_failed(self):
+        args = self.parse_args("--no-fetch", "1", "2", "develop")
+        self.command.local_rebases = \
+            lambda pr_numbers, newbase, old_branch, remote: ([], [1, 2])
+        with pytest.raises(Stop) as exc:
+            self.command.rebase_prs(args, "master")
+        assert exc.value.rc == 24
+        assert self.command.main_repo.checkouts == ["master"]
+
+    def test_rebase_pr_error(self):
+        args = self.parse_args("--no-fetch", "1", "develop")
+
+        def local_rebase(pr_number, newbase, remote, skip):
+            return MockPR(pr_number), "rebased/develop/1"
+
+        def open_pr(new_branch, newbase, pr):
+            raise GithubException(422, "Unprocessable Entity")
+
+        self.command.local_rebase = local_rebase
+        self.command.push_branch = lambda new_branch: None
+        self.command.open_pr = open_pr
+        with pytest.raises(GithubException):
+            self.command.rebase_pr(args, "master")
+        assert self.command.main_repo.checkouts == ["master"]
+
+    @parametrize_jobs
+    def test_open_prs(self, jobs, capsys, monkeypatch):
+        waits = []
+        monkeypatch.setattr(Throttle, "wait", lambda self: waits.append(1))
+
+        def open_pr(new_branch, newbase, pr):
+            if pr.number < 0:
+                raise GithubException(422, "Unprocessable Entity")
+            return "https://github.com/mock/mock/pull/%s" % (pr.number + 10)
+
+        self.command.open_pr = open_pr
+        rebased = [(MockPR(x), "branch%s" % x) for x in (1, -2, 3)]
+        failed = self.command.open_prs(rebased, "develop", jobs=jobs,
+                                       rate=100)
+        assert failed == [-2]
+        assert len(waits) == 3
+        assert capsys.readouterr()[0].splitlines() == [
+            "https://github.com/mock/mock/pull/11",
+            "https://github.com/mock/mock/pull/13"]